@@ -5,6 +5,7 @@ Configuration management for GenOS Backend
 from pydantic_settings import BaseSettings
 from typing import Optional
 import os
+import tempfile
 
 class Settings(BaseSettings):
     """Application settings"""
@@ -31,14 +32,20 @@ class Settings(BaseSettings):
     # VM Runtime Configuration
     vm_storage_path: str = "/var/lib/genos/vms"
     vm_images_path: str = "/var/lib/genos/images"
+    download_base_images: bool = False  # Placeholders are created when disabled
     max_concurrent_vms: int = 10
     default_vm_memory: int = 2048  # MB
     default_vm_cpu: int = 2
+    container_warm_pool_size: int = 2  # Pre-started containers per warm spec
     
     # Streaming Configuration
     streaming_host: str = "0.0.0.0"
+    streaming_websocket_port: int = 8765
+    streaming_reuse_port: bool = False  # Lets every API worker bind the websocket port; needs sticky routing
     streaming_port_range_start: int = 5900
     streaming_port_range_end: int = 5999
+    port_registry_path: str = os.path.join(tempfile.gettempdir(), "genos", "ports.json")  # Shared across manager processes
+    spice_zstd_dictionary_path: Optional[str] = None  # Trained frame dictionary; SPICE uses LZ4 without one
     
     # NLP Configuration
     nlp_model_path: str = "en_core_web_sm"
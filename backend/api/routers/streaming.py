@@ -12,6 +12,7 @@ import asyncio
 from ..models.database import get_db, Environment, User
 from ..models.schemas import ClientType
 from ..routers.auth import get_current_active_user, get_user_from_token
+from ..core.config import settings
 from ..core.logging import get_logger
 from ...streaming.gateway import streaming_gateway, StreamingProtocol, StreamQuality
 
@@ -61,7 +62,7 @@ async def create_streaming_connection(
         
         return {
             "connection_id": connection_id,
-            "websocket_url": f"ws://localhost:8765/{connection_id}",
+            "websocket_url": f"ws://localhost:{settings.streaming_websocket_port}/{connection_id}",
             "protocol": protocol.value,
             "quality": quality.value,
             "status": "created"
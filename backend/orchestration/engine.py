@@ -4,11 +4,14 @@ Manages the lifecycle of virtualized environments
 """
 
 import asyncio
+import os
 import uuid
 import json
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Mapping, AsyncIterator
 from datetime import datetime, timedelta
 from enum import Enum
+from types import MappingProxyType
+from weakref import WeakValueDictionary
 import logging
 
 from ..api.models.schemas import EnvironmentSpec, EnvironmentStatus
@@ -19,6 +22,9 @@ from ..api.core.logging import get_logger
 
 logger = get_logger(__name__)
 
+# Apps light enough to run in a container instead of a full VM
+CONTAINER_SIMPLE_APPS = frozenset({"firefox", "chrome", "terminal", "python", "nodejs"})
+
 class ProvisioningStrategy(Enum):
     """Provisioning strategy for environments"""
     VM_ONLY = "vm_only"
@@ -58,7 +64,7 @@ class ResourcePool:
                 "disk": disk,
                 "allocated_at": datetime.utcnow()
             }
-            logger.info(f"Allocated resources for {env_id}: {cpu}CPU, {memory}MB, {disk}GB")
+            logger.debug("Allocated resources for %s: %sCPU, %sMB, %sGB", env_id, cpu, memory, disk)
             return True
         return False
     
@@ -85,14 +91,22 @@ class ResourcePool:
 class OrchestrationEngine:
     """Main orchestration engine for managing environments"""
     
-    def __init__(self):
+    def __init__(self, n_workers: Optional[int] = None):
         self.vm_manager = VMManager()
         self.container_manager = ContainerManager()
         self.security_sandbox = SecuritySandbox()
         self.resource_pool = ResourcePool()
         self.environments: Dict[str, Dict] = {}
+        self.security_configs: Dict[str, Dict[str, Any]] = {}  # kept out of status views
+        self._env_locks: WeakValueDictionary[str, asyncio.Lock] = WeakValueDictionary()
         self.provisioning_queue: asyncio.Queue = asyncio.Queue()
+        self._pending_actions: Dict[str, Dict[str, str]] = {}  # env_id -> its last queued task
         self.worker_tasks: List[asyncio.Task] = []
+        self.n_workers = n_workers or max(2, min(8, os.cpu_count() or 4))
+        self._task_group: Optional[asyncio.TaskGroup] = None
+        self._scale_lock = asyncio.Lock()
+        self._worker_seq = 0
+        self._pending_exits = 0
         self.running = False
     
     async def start(self):
@@ -105,24 +119,83 @@ class OrchestrationEngine:
         await self.container_manager.initialize()
         await self.security_sandbox.initialize()
         
-        # Start worker tasks
-        for i in range(3):  # 3 worker tasks for parallel provisioning
-            task = asyncio.create_task(self._provisioning_worker(f"worker-{i}"))
-            self.worker_tasks.append(task)
+        # Start worker tasks under a task group so shutdown is structured
+        self._task_group = asyncio.TaskGroup()
+        await self._task_group.__aenter__()
+        for _ in range(self.n_workers):
+            self._spawn_worker()
         
-        logger.info("Orchestration engine started")
+        logger.info(f"Orchestration engine started with {self.n_workers} workers")
+    
+    async def set_scale(self, n: int):
+        """Grow or shrink the provisioning worker pool to n workers"""
+        n = max(1, n)
+        async with self._scale_lock:
+            if self._task_group is None:
+                self.n_workers = n
+                return
+            
+            current = len(self.worker_tasks) - self._pending_exits
+            if n > current:
+                for _ in range(n - current):
+                    self._spawn_worker()
+            elif n < current:
+                # Idle workers pick up a sentinel and exit once their current task finishes
+                for _ in range(current - n):
+                    self.provisioning_queue.put_nowait(None)
+                self._pending_exits += current - n
+            
+            self.n_workers = n
+            logger.info(f"Provisioning workers scaled from {current} to {n}")
+    
+    def _spawn_worker(self):
+        """Start one provisioning worker inside the task group"""
+        worker_id = f"worker-{self._worker_seq}"
+        self._worker_seq += 1
+        task = self._task_group.create_task(self._provisioning_worker(worker_id))
+        self.worker_tasks.append(task)
+        task.add_done_callback(self._on_worker_done)
+    
+    def _on_worker_done(self, task: asyncio.Task):
+        """Forget a worker once it exits"""
+        if task in self.worker_tasks:
+            self.worker_tasks.remove(task)
+            if self._pending_exits:
+                self._pending_exits -= 1
     
     async def stop(self):
         """Stop the orchestration engine"""
         logger.info("Stopping orchestration engine")
         self.running = False
         
-        # Cancel worker tasks
-        for task in self.worker_tasks:
-            task.cancel()
-        
-        # Wait for tasks to complete
-        await asyncio.gather(*self.worker_tasks, return_exceptions=True)
+        # Abandon queued actions so shutdown doesn't provision environments only for
+        # cleanup to tear them down again; scale-down sentinels go with them
+        while not self.provisioning_queue.empty():
+            self.provisioning_queue.get_nowait()
+            self.provisioning_queue.task_done()
+        self._pending_actions.clear()
+        
+        # Wake each worker still running with a shutdown sentinel (the drain above also
+        # removed any scale-down sentinels) and wait for the group to finish
+        for _ in self.worker_tasks:
+            self.provisioning_queue.put_nowait(None)
+        
+        if self._task_group is not None:
+            await self._task_group.__aexit__(None, None, None)
+            self._task_group = None
+        self.worker_tasks.clear()
+        self._pending_exits = 0
+        
+        # Sentinels nobody consumed would make the next start()'s workers exit at once;
+        # anything else queued during shutdown is kept for that start()
+        leftover = []
+        while not self.provisioning_queue.empty():
+            task = self.provisioning_queue.get_nowait()
+            self.provisioning_queue.task_done()
+            if task is not None:
+                leftover.append(task)
+        for task in leftover:
+            self.provisioning_queue.put_nowait(task)
         
         # Cleanup components
         await self.vm_manager.cleanup()
@@ -154,10 +227,7 @@ class OrchestrationEngine:
         self.environments[env_id] = environment
         
         # Add to provisioning queue
-        await self.provisioning_queue.put({
-            "action": "provision",
-            "env_id": env_id
-        })
+        await self._enqueue(env_id, "provision")
         
         logger.info(f"Environment {env_id} queued for provisioning")
         return environment
@@ -170,15 +240,12 @@ class OrchestrationEngine:
         
         environment = self.environments[env_id]
         
-        if environment["status"] != EnvironmentStatus.SUSPENDED:
+        if environment["status"] is not EnvironmentStatus.SUSPENDED:
             logger.error(f"Cannot start environment {env_id} in status {environment['status']}")
             return False
         
         # Add to provisioning queue
-        await self.provisioning_queue.put({
-            "action": "start",
-            "env_id": env_id
-        })
+        await self._enqueue(env_id, "start")
         
         return True
     
@@ -190,15 +257,12 @@ class OrchestrationEngine:
         
         environment = self.environments[env_id]
         
-        if environment["status"] != EnvironmentStatus.RUNNING:
+        if environment["status"] is not EnvironmentStatus.RUNNING:
             logger.error(f"Cannot stop environment {env_id} in status {environment['status']}")
             return False
         
         # Add to provisioning queue
-        await self.provisioning_queue.put({
-            "action": "stop",
-            "env_id": env_id
-        })
+        await self._enqueue(env_id, "stop")
         
         return True
     
@@ -209,67 +273,96 @@ class OrchestrationEngine:
             return False
         
         # Add to provisioning queue
-        await self.provisioning_queue.put({
-            "action": "terminate",
-            "env_id": env_id
-        })
+        await self._enqueue(env_id, "terminate")
         
         return True
     
-    async def get_environment_status(self, env_id: str) -> Optional[Dict[str, Any]]:
-        """Get environment status"""
+    async def _enqueue(self, env_id: str, action: str):
+        """Queue an action unless the same action is already pending for the environment"""
+        pending = self._pending_actions.get(env_id)
+        if pending is not None and pending["action"] == action:
+            logger.debug("Coalesced duplicate %s for environment %s", action, env_id)
+            return
+        
+        task = {
+            "action": action,
+            "env_id": env_id
+        }
+        self._pending_actions[env_id] = task
+        await self.provisioning_queue.put(task)
+    
+    async def get_environment_status(self, env_id: str) -> Optional[Mapping[str, Any]]:
+        """Get a read-only view of the environment status"""
         if env_id in self.environments:
-            return self.environments[env_id].copy()
+            return MappingProxyType(self.environments[env_id])
         return None
     
-    async def list_environments(self, user_id: Optional[int] = None) -> List[Dict[str, Any]]:
-        """List environments, optionally filtered by user"""
-        environments = []
-        for env in self.environments.values():
+    async def iter_environments(self, user_id: Optional[int] = None) -> AsyncIterator[Mapping[str, Any]]:
+        """Yield read-only environment views, optionally filtered by user"""
+        # Snapshot the references so environments created mid-iteration don't break the loop
+        for env in list(self.environments.values()):
             if user_id is None or env["user_id"] == user_id:
-                environments.append(env.copy())
-        return environments
+                yield MappingProxyType(env)
+    
+    async def list_environments(self, user_id: Optional[int] = None) -> List[Mapping[str, Any]]:
+        """List environments, optionally filtered by user"""
+        return [env async for env in self.iter_environments(user_id)]
     
     def _determine_strategy(self, spec: EnvironmentSpec) -> ProvisioningStrategy:
         """Determine the best provisioning strategy for a specification"""
         # Simple heuristics for strategy selection
+        gpu, base_os, memory_mb, cpu_cores, apps = (
+            spec.gpu_enabled, spec.base_os.lower(), spec.memory_mb, spec.cpu_cores, spec.apps
+        )
         
         # If GPU is required, use VM
-        if spec.gpu_enabled:
+        if gpu:
             return ProvisioningStrategy.VM_ONLY
         
         # If Windows or macOS, use VM
-        if "windows" in spec.base_os.lower() or "macos" in spec.base_os.lower():
+        if "windows" in base_os or "macos" in base_os:
             return ProvisioningStrategy.VM_ONLY
         
         # If high resource requirements, use VM
-        if spec.memory_mb > 4096 or spec.cpu_cores > 4:
+        if memory_mb > 4096 or cpu_cores > 4:
             return ProvisioningStrategy.VM_ONLY
         
         # If only simple apps, use container
-        simple_apps = ["firefox", "chrome", "terminal", "python", "nodejs"]
-        if all(app in simple_apps for app in spec.apps):
+        if CONTAINER_SIMPLE_APPS.issuperset(apps):
             return ProvisioningStrategy.CONTAINER_ONLY
         
         # Default to VM for full OS experience
         return ProvisioningStrategy.VM_ONLY
     
+    def _lock(self, env_id: str) -> asyncio.Lock:
+        """Get the lock serializing mutations of a single environment"""
+        lock = self._env_locks.get(env_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._env_locks[env_id] = lock
+        return lock
+    
     async def _provisioning_worker(self, worker_id: str):
         """Worker task for processing provisioning queue"""
         logger.info(f"Provisioning worker {worker_id} started")
         
-        while self.running:
+        while True:
             try:
                 # Get next task from queue
-                task = await asyncio.wait_for(
-                    self.provisioning_queue.get(),
-                    timeout=1.0
-                )
+                task = await self.provisioning_queue.get()
+                
+                # Shutdown sentinel
+                if task is None:
+                    self.provisioning_queue.task_done()
+                    break
                 
                 env_id = task["env_id"]
                 action = task["action"]
+                # Only this exact task clears the marker; a later queued one of the same action keeps it
+                if self._pending_actions.get(env_id) is task:
+                    del self._pending_actions[env_id]
                 
-                logger.info(f"Worker {worker_id} processing {action} for environment {env_id}")
+                logger.debug("Worker %s processing %s for environment %s", worker_id, action, env_id)
                 
                 if action == "provision":
                     await self._provision_environment(env_id)
@@ -283,9 +376,6 @@ class OrchestrationEngine:
                 # Mark task as done
                 self.provisioning_queue.task_done()
                 
-            except asyncio.TimeoutError:
-                # No tasks in queue, continue
-                continue
             except Exception as e:
                 logger.error(f"Worker {worker_id} error: {str(e)}")
                 continue
@@ -294,128 +384,133 @@ class OrchestrationEngine:
     
     async def _provision_environment(self, env_id: str):
         """Provision a new environment"""
-        environment = self.environments[env_id]
-        spec = EnvironmentSpec(**environment["specification"])
-        
-        try:
-            # Update status
-            environment["status"] = EnvironmentStatus.PROVISIONING
-            
-            # Check resource availability
-            if not self.resource_pool.can_allocate(spec.cpu_cores, spec.memory_mb, spec.disk_gb):
-                logger.error(f"Insufficient resources for environment {env_id}")
-                environment["status"] = EnvironmentStatus.ERROR
-                environment["metadata"]["error"] = "Insufficient resources"
-                return
+        async with self._lock(env_id):
+            environment = self.environments[env_id]
+            spec = EnvironmentSpec(**environment["specification"])
             
-            # Allocate resources
-            self.resource_pool.allocate(env_id, spec.cpu_cores, spec.memory_mb, spec.disk_gb)
-            
-            # Apply security policies
-            security_config = await self.security_sandbox.create_security_config(spec)
-            environment["metadata"]["security_config"] = security_config
-            
-            # Provision based on strategy
-            if environment["strategy"] == ProvisioningStrategy.VM_ONLY:
-                vm_id = await self.vm_manager.create_vm(env_id, spec, security_config)
-                environment["vm_id"] = vm_id
+            try:
+                # Update status
+                environment["status"] = EnvironmentStatus.PROVISIONING
                 
-                # Start VM
-                await self.vm_manager.start_vm(vm_id)
+                # Check resource availability
+                if not self.resource_pool.can_allocate(spec.cpu_cores, spec.memory_mb, spec.disk_gb):
+                    logger.error(f"Insufficient resources for environment {env_id}")
+                    environment["status"] = EnvironmentStatus.ERROR
+                    environment["metadata"]["error"] = "Insufficient resources"
+                    return
                 
-                # Get streaming port
-                streaming_port = await self.vm_manager.get_streaming_port(vm_id)
-                environment["streaming_port"] = streaming_port
+                # Allocate resources
+                self.resource_pool.allocate(env_id, spec.cpu_cores, spec.memory_mb, spec.disk_gb)
                 
-            elif environment["strategy"] == ProvisioningStrategy.CONTAINER_ONLY:
-                container_id = await self.container_manager.create_container(env_id, spec, security_config)
-                environment["container_id"] = container_id
+                # Apply security policies
+                security_config = await self.security_sandbox.create_security_config(spec)
+                self.security_configs[env_id] = security_config
                 
-                # Start container
-                await self.container_manager.start_container(container_id)
+                # Provision based on strategy
+                if environment["strategy"] is ProvisioningStrategy.VM_ONLY:
+                    vm_id = await self.vm_manager.create_vm(env_id, spec, security_config)
+                    environment["vm_id"] = vm_id
+                    
+                    # Start VM
+                    await self.vm_manager.start_vm(vm_id)
+                    
+                    # Get streaming port
+                    streaming_port = await self.vm_manager.get_streaming_port(vm_id)
+                    environment["streaming_port"] = streaming_port
+                    
+                elif environment["strategy"] is ProvisioningStrategy.CONTAINER_ONLY:
+                    container_id = await self.container_manager.create_container(env_id, spec, security_config)
+                    environment["container_id"] = container_id
+                    
+                    # Start container
+                    await self.container_manager.start_container(container_id)
+                    
+                    # Get streaming port (for X11 forwarding)
+                    streaming_port = await self.container_manager.get_streaming_port(container_id)
+                    environment["streaming_port"] = streaming_port
                 
-                # Get streaming port (for X11 forwarding)
-                streaming_port = await self.container_manager.get_streaming_port(container_id)
-                environment["streaming_port"] = streaming_port
-            
-            # Update status
-            environment["status"] = EnvironmentStatus.RUNNING
-            environment["started_at"] = datetime.utcnow()
-            
-            logger.info(f"Environment {env_id} provisioned successfully")
-            
-        except Exception as e:
-            logger.error(f"Failed to provision environment {env_id}: {str(e)}")
-            environment["status"] = EnvironmentStatus.ERROR
-            environment["metadata"]["error"] = str(e)
-            
-            # Cleanup resources
-            self.resource_pool.deallocate(env_id)
+                # Update status
+                environment["status"] = EnvironmentStatus.RUNNING
+                environment["started_at"] = datetime.utcnow()
+                
+                logger.info(f"Environment {env_id} provisioned successfully")
+                
+            except Exception as e:
+                logger.error(f"Failed to provision environment {env_id}: {str(e)}")
+                environment["status"] = EnvironmentStatus.ERROR
+                environment["metadata"]["error"] = str(e)
+                
+                # Cleanup resources
+                self.resource_pool.deallocate(env_id)
     
     async def _start_environment(self, env_id: str):
         """Start a suspended environment"""
-        environment = self.environments[env_id]
-        
-        try:
-            environment["status"] = EnvironmentStatus.PROVISIONING
+        async with self._lock(env_id):
+            environment = self.environments[env_id]
             
-            if environment["vm_id"]:
-                await self.vm_manager.start_vm(environment["vm_id"])
-            elif environment["container_id"]:
-                await self.container_manager.start_container(environment["container_id"])
-            
-            environment["status"] = EnvironmentStatus.RUNNING
-            environment["started_at"] = datetime.utcnow()
-            
-            logger.info(f"Environment {env_id} started successfully")
-            
-        except Exception as e:
-            logger.error(f"Failed to start environment {env_id}: {str(e)}")
-            environment["status"] = EnvironmentStatus.ERROR
-            environment["metadata"]["error"] = str(e)
+            try:
+                environment["status"] = EnvironmentStatus.PROVISIONING
+                
+                if environment["vm_id"]:
+                    await self.vm_manager.start_vm(environment["vm_id"])
+                elif environment["container_id"]:
+                    await self.container_manager.start_container(environment["container_id"])
+                
+                environment["status"] = EnvironmentStatus.RUNNING
+                environment["started_at"] = datetime.utcnow()
+                
+                logger.info(f"Environment {env_id} started successfully")
+                
+            except Exception as e:
+                logger.error(f"Failed to start environment {env_id}: {str(e)}")
+                environment["status"] = EnvironmentStatus.ERROR
+                environment["metadata"]["error"] = str(e)
     
     async def _stop_environment(self, env_id: str):
         """Stop a running environment"""
-        environment = self.environments[env_id]
-        
-        try:
-            if environment["vm_id"]:
-                await self.vm_manager.stop_vm(environment["vm_id"])
-            elif environment["container_id"]:
-                await self.container_manager.stop_container(environment["container_id"])
-            
-            environment["status"] = EnvironmentStatus.SUSPENDED
-            environment["stopped_at"] = datetime.utcnow()
-            
-            logger.info(f"Environment {env_id} stopped successfully")
+        async with self._lock(env_id):
+            environment = self.environments[env_id]
             
-        except Exception as e:
-            logger.error(f"Failed to stop environment {env_id}: {str(e)}")
-            environment["status"] = EnvironmentStatus.ERROR
-            environment["metadata"]["error"] = str(e)
+            try:
+                if environment["vm_id"]:
+                    await self.vm_manager.stop_vm(environment["vm_id"])
+                elif environment["container_id"]:
+                    await self.container_manager.stop_container(environment["container_id"])
+                
+                environment["status"] = EnvironmentStatus.SUSPENDED
+                environment["stopped_at"] = datetime.utcnow()
+                
+                logger.info(f"Environment {env_id} stopped successfully")
+                
+            except Exception as e:
+                logger.error(f"Failed to stop environment {env_id}: {str(e)}")
+                environment["status"] = EnvironmentStatus.ERROR
+                environment["metadata"]["error"] = str(e)
     
     async def _terminate_environment(self, env_id: str):
         """Terminate an environment"""
-        environment = self.environments[env_id]
-        
-        try:
-            if environment["vm_id"]:
-                await self.vm_manager.destroy_vm(environment["vm_id"])
-            elif environment["container_id"]:
-                await self.container_manager.destroy_container(environment["container_id"])
-            
-            # Deallocate resources
-            self.resource_pool.deallocate(env_id)
+        async with self._lock(env_id):
+            environment = self.environments[env_id]
             
-            environment["status"] = EnvironmentStatus.TERMINATED
-            environment["terminated_at"] = datetime.utcnow()
-            
-            logger.info(f"Environment {env_id} terminated successfully")
-            
-        except Exception as e:
-            logger.error(f"Failed to terminate environment {env_id}: {str(e)}")
-            environment["status"] = EnvironmentStatus.ERROR
-            environment["metadata"]["error"] = str(e)
+            try:
+                if environment["vm_id"]:
+                    await self.vm_manager.destroy_vm(environment["vm_id"])
+                elif environment["container_id"]:
+                    await self.container_manager.destroy_container(environment["container_id"])
+                
+                # Deallocate resources
+                self.resource_pool.deallocate(env_id)
+                self.security_configs.pop(env_id, None)
+                
+                environment["status"] = EnvironmentStatus.TERMINATED
+                environment["terminated_at"] = datetime.utcnow()
+                
+                logger.info(f"Environment {env_id} terminated successfully")
+                
+            except Exception as e:
+                logger.error(f"Failed to terminate environment {env_id}: {str(e)}")
+                environment["status"] = EnvironmentStatus.ERROR
+                environment["metadata"]["error"] = str(e)
 
 # Global orchestration engine instance
 orchestration_engine = OrchestrationEngine()
@@ -4,47 +4,187 @@ Manages Docker and LXC containers for lightweight environments
 """
 
 import asyncio
+import codecs
+import hashlib
+import io
 import json
+import time
 import uuid
-from typing import Dict, List, Optional, Any
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
+from types import MappingProxyType
+from typing import AsyncIterator, Deque, Dict, Iterator, List, Mapping, Optional, Any, Set, Tuple
 from pathlib import Path
-import docker
-import docker.errors
 
 from ..api.models.schemas import EnvironmentSpec, NetworkMode
 from ..api.core.config import settings
 from ..api.core.logging import get_logger
+from .port_registry import PortRegistry
 
 logger = get_logger(__name__)
 
+# Upper bound on concurrent dockerd requests issued by batch operations
+DOCKER_BATCH_CONCURRENCY = 8
+
+# Threads available for blocking docker-py calls; also caps concurrent dockerd requests
+DOCKER_POOL_SIZE = 8
+
+# Seconds between container status polls while the docker events stream is down
+READY_POLL_INTERVAL = 0.5
+
+# Specs kept pre-started in the warm pool; requests matching one of these skip container creation
+WARM_POOL_SPECS = (
+    {"base_os": "ubuntu_22.04", "apps": ["terminal"]},
+    {"base_os": "ubuntu_22.04", "apps": ["firefox"]},
+)
+
+# Map OS specification to Docker image
+IMAGE_MAP = {
+    "ubuntu_22.04": "ubuntu:22.04",
+    "ubuntu_20.04": "ubuntu:20.04",
+    "fedora_38": "fedora:38",
+    "alpine_latest": "alpine:latest"
+}
+
+# Install command per supported application
+APP_PACKAGES = {
+    "firefox": "apt-get install -y firefox",
+    "chrome": "wget -q -O - https://dl.google.com/linux/linux_signing_key.pub | apt-key add - && echo 'deb [arch=amd64] http://dl.google.com/linux/chrome/deb/ stable main' > /etc/apt/sources.list.d/google-chrome.list && apt-get update && apt-get install -y google-chrome-stable",
+    "tor_browser": "apt-get install -y tor torbrowser-launcher",
+    "vscode": "wget -qO- https://packages.microsoft.com/keys/microsoft.asc | gpg --dearmor > packages.microsoft.gpg && install -o root -g root -m 644 packages.microsoft.gpg /etc/apt/trusted.gpg.d/ && echo 'deb [arch=amd64,arm64,armhf signed-by=/etc/apt/trusted.gpg.d/packages.microsoft.gpg] https://packages.microsoft.com/repos/code stable main' > /etc/apt/sources.list.d/vscode.list && apt-get update && apt-get install -y code",
+    "python": "apt-get install -y python3 python3-pip",
+    "nodejs": "curl -fsSL https://deb.nodesource.com/setup_18.x | bash - && apt-get install -y nodejs",
+    "git": "apt-get install -y git",
+    "terminal": "apt-get install -y gnome-terminal",
+    "office": "apt-get install -y libreoffice",
+    "gimp": "apt-get install -y gimp",
+    "vlc": "apt-get install -y vlc"
+}
+
+@lru_cache(maxsize=128)
+def _app_install_commands(apps: Tuple[str, ...]) -> str:
+    """Build the install command chain for a sorted tuple of apps"""
+    install_commands = [APP_PACKAGES[app] for app in apps if app in APP_PACKAGES]
+    return " && ".join(install_commands) if install_commands else "echo 'No apps to install'"
+
+# Display stack started in every container once its packages are present
+DISPLAY_SERVER_COMMAND = (
+    "Xvfb :1 -screen 0 1024x768x16 & "
+    "x11vnc -display :1 -nopw -listen localhost -xkb -rfbport 5901 & "
+    "sleep infinity"
+)
+
+# Repository for images with the display stack and apps baked in
+PREBUILT_IMAGE_REPO = "genos-cache"
+
+# Startup command for prebuilt images, which need no package installs
+PREBUILT_STARTUP_COMMAND = ("bash", "-c", DISPLAY_SERVER_COMMAND)
+
+@lru_cache(maxsize=128)
+def _startup_command(apps: Tuple[str, ...]) -> Tuple[str, ...]:
+    """Build the container startup command for a sorted tuple of apps"""
+    return (
+        "bash", "-c",
+        " && ".join([
+            "apt-get update",
+            "apt-get install -y xvfb x11vnc supervisor",
+            "mkdir -p /var/log/supervisor",
+            _app_install_commands(apps),
+            DISPLAY_SERVER_COMMAND
+        ])
+    )
+
+@lru_cache(maxsize=128)
+def _prebuilt_dockerfile(base_image: str, apps: Tuple[str, ...]) -> str:
+    """Dockerfile baking the display stack and apps into an image"""
+    return "\n".join([
+        f"FROM {base_image}",
+        "ENV DEBIAN_FRONTEND=noninteractive",
+        "RUN apt-get update && apt-get install -y xvfb x11vnc supervisor && mkdir -p /var/log/supervisor",
+        f"RUN {_app_install_commands(apps)}",
+        ""
+    ])
+
 class ContainerManager:
     """Manages containers using Docker and LXC"""
     
     def __init__(self):
         self.containers: Dict[str, Dict] = {}
+        
+        # Compact side tables mirroring hot record fields for bulk scans
+        self._container_status: Dict[str, str] = {}
+        self._container_created: Dict[str, float] = {}
+        self._env_index: Dict[str, Set[str]] = {}
+        self._by_docker_id: Dict[str, str] = {}
         self.docker_client = None
-        self.streaming_port_pool = list(range(
+        # docker-py is imported lazily in initialize() so VM-only hosts never load it
+        self._docker_errors = None
+        self._docker_connection_errors: Tuple[type, ...] = ()
+        # Created per initialize() and shut down by cleanup(), so a stop/start cycle gets a fresh pool
+        self._docker_pool: Optional[ThreadPoolExecutor] = None
+        self._free_ports: set[int] = set(range(
             settings.streaming_port_range_start + 1000,  # Offset from VM ports
             settings.streaming_port_range_end + 1000
         ))
         self.allocated_ports: Dict[str, int] = {}
+        self._port_registry = PortRegistry(settings.port_registry_path)
+        
+        # Warm pool of pre-started containers keyed by the spec fields that shape the container
+        self._warm_pool: Dict[Tuple, Deque[str]] = {}
+        self._warm_specs: Dict[Tuple, EnvironmentSpec] = {}
+        self._refill_tasks: Dict[Tuple, asyncio.Task] = {}
+        
+        # Prebuilt image tags keyed by (base_image, sorted apps)
+        self._prebuilt_images: Dict[Tuple[str, Tuple[str, ...]], str] = {}
+        self._prepare_task: Optional[asyncio.Task] = None
+        
+        # Single docker events subscription shared by all containers, keyed by docker id
+        self._ready_events: Dict[str, asyncio.Event] = {}
+        self._events_stream = None
+        self._events_task: Optional[asyncio.Task] = None
     
     async def initialize(self):
         """Initialize the container manager"""
         logger.info("Initializing container manager")
         
+        try:
+            import docker
+            import docker.errors
+            from requests.exceptions import ConnectionError as DockerConnectionError
+        except ImportError as e:
+            logger.error(f"Docker SDK not installed: {str(e)}")
+            logger.info("Container manager initialized")
+            return
+        
+        self._docker_errors = docker.errors
+        self._docker_connection_errors = (DockerConnectionError,)
+        self._docker_pool = ThreadPoolExecutor(max_workers=DOCKER_POOL_SIZE, thread_name_prefix="docker")
+        
         try:
             # Initialize Docker client
-            self.docker_client = docker.from_env()
+            self.docker_client = await self._docker_call(docker.from_env)
             
             # Test Docker connection
-            self.docker_client.ping()
+            await self._docker_call(self.docker_client.ping)
             logger.info("Docker connection established")
             
+            # Subscribe to container lifecycle events; the long-lived consumer runs on the
+            # default executor so it never holds a docker pool slot
+            self._events_stream = await self._docker_call(
+                self.docker_client.events, decode=True, filters={"type": "container"}
+            )
+            self._events_task = asyncio.create_task(
+                asyncio.to_thread(self._consume_docker_events, asyncio.get_running_loop())
+            )
+            
             # Pull base images
             await self._initialize_base_images()
             
-        except docker.errors.DockerException as e:
+            # Bake images for common specs, then pre-start warm containers from them
+            self._prepare_task = asyncio.create_task(self._prepare_warm_specs())
+            
+        except (docker.errors.DockerException, DockerConnectionError) as e:
             logger.error(f"Docker not available: {str(e)}")
             self.docker_client = None
         
@@ -54,15 +194,39 @@ class ContainerManager:
         """Cleanup container manager resources"""
         logger.info("Cleaning up container manager")
         
+        # Stop preparing and refilling the warm pool before tearing containers down
+        if self._prepare_task is not None:
+            self._prepare_task.cancel()
+            await asyncio.gather(self._prepare_task, return_exceptions=True)
+            self._prepare_task = None
+        for task in self._refill_tasks.values():
+            task.cancel()
+        await asyncio.gather(*self._refill_tasks.values(), return_exceptions=True)
+        self._refill_tasks.clear()
+        self._warm_pool.clear()
+        
         # Stop all running containers
-        for container_id in list(self.containers.keys()):
-            try:
-                await self.destroy_container(container_id)
-            except Exception as e:
-                logger.error(f"Error destroying container {container_id}: {str(e)}")
+        container_ids = list(self._container_status)
+        results = await self._gather_bounded(
+            self.destroy_container(container_id) for container_id in container_ids
+        )
+        for container_id, result in zip(container_ids, results):
+            if isinstance(result, Exception):
+                logger.error(f"Error destroying container {container_id}: {str(result)}")
+        
+        # Close the events stream; the consumer thread exits once it sees the socket close
+        if self._events_stream is not None:
+            self._events_stream.close()
+            await asyncio.gather(self._events_task, return_exceptions=True)
+            self._events_stream = None
+            self._events_task = None
         
         if self.docker_client:
-            self.docker_client.close()
+            await self._docker_call(self.docker_client.close)
+        
+        if self._docker_pool is not None:
+            self._docker_pool.shutdown(wait=False)
+            self._docker_pool = None
         
         logger.info("Container manager cleanup completed")
     
@@ -71,30 +235,27 @@ class ContainerManager:
         if not self.docker_client:
             raise RuntimeError("Docker not available")
         
+        # Hand out a pre-started container if one matches this spec
+        key = self._warm_pool_key(spec)
+        warm_pool = self._warm_pool.get(key)
+        if warm_pool:
+            container_id = warm_pool.popleft()
+            container = self.containers[container_id]
+            container["env_id"] = env_id
+            container["config"]["security"] = security_config
+            self._env_index.setdefault(env_id, set()).add(container_id)
+            self._set_status(container_id, "created")
+            self._schedule_warm_refill(key)
+            
+            logger.info(f"Assigned warm container {container_id} to environment {env_id}")
+            return container_id
+        
         container_id = f"genos-{env_id}-{uuid.uuid4().hex[:8]}"
         
         logger.info(f"Creating container {container_id} for environment {env_id}")
         
         try:
-            # Create container configuration
-            container_config = await self._create_container_config(container_id, spec, security_config)
-            
-            # Allocate streaming port
-            streaming_port = self._allocate_streaming_port(container_id)
-            container_config["streaming_port"] = streaming_port
-            
-            # Create Docker container
-            docker_container = await self._create_docker_container(container_id, container_config)
-            
-            # Store container configuration
-            self.containers[container_id] = {
-                "id": container_id,
-                "env_id": env_id,
-                "docker_id": docker_container.id,
-                "config": container_config,
-                "status": "created",
-                "created_at": asyncio.get_event_loop().time()
-            }
+            await self._build_container(container_id, env_id, spec, security_config)
             
             logger.info(f"Container {container_id} created successfully")
             return container_id
@@ -103,6 +264,135 @@ class ContainerManager:
             logger.error(f"Failed to create container {container_id}: {str(e)}")
             raise
     
+    async def _build_container(self, container_id: str, env_id: Optional[str], spec: EnvironmentSpec,
+                               security_config: Dict) -> Dict:
+        """Create the Docker container and its record"""
+        # Allocate streaming port
+        streaming_port = await self._allocate_streaming_port(container_id)
+        
+        try:
+            # Create container configuration
+            container_config = await self._create_container_config(
+                container_id, spec, security_config, streaming_port
+            )
+            
+            # Create Docker container
+            docker_container = await self._create_docker_container(container_id, container_config)
+        except Exception:
+            await self._release_streaming_port(container_id)
+            raise
+        
+        self._ready_events[docker_container.id] = asyncio.Event()
+        
+        # Store container configuration
+        container = {
+            "id": container_id,
+            "env_id": env_id,
+            "docker_id": docker_container.id,
+            "docker_obj": docker_container,
+            "config": container_config,
+            "status": "created",
+            "created_at": time.monotonic()
+        }
+        self.containers[container_id] = container
+        self._container_status[container_id] = "created"
+        self._container_created[container_id] = container["created_at"]
+        self._by_docker_id[docker_container.id] = container_id
+        if env_id is not None:
+            self._env_index.setdefault(env_id, set()).add(container_id)
+        return container
+    
+    def _set_status(self, container_id: str, status: str):
+        """Update a container's status in its record and the status side table"""
+        self.containers[container_id]["status"] = status
+        self._container_status[container_id] = status
+    
+    def list_containers(self, status: Optional[str] = None, oldest_first: bool = False) -> List[str]:
+        """List container ids, optionally filtered by status and ordered by creation time"""
+        if status is None:
+            container_ids = list(self._container_status)
+        else:
+            container_ids = [cid for cid, cstatus in self._container_status.items() if cstatus == status]
+        
+        if oldest_first:
+            container_ids.sort(key=self._container_created.__getitem__)
+        return container_ids
+    
+    def get_env_containers(self, env_id: str) -> Set[str]:
+        """Container ids belonging to an environment"""
+        return set(self._env_index.get(env_id, ()))
+    
+    async def _prepare_warm_specs(self):
+        """Build prebuilt images for WARM_POOL_SPECS and start filling their warm pools"""
+        specs = [EnvironmentSpec(**spec_fields) for spec_fields in WARM_POOL_SPECS]
+        
+        await self._gather_bounded(
+            self._ensure_prebuilt_image(IMAGE_MAP.get(spec.base_os, "ubuntu:22.04"), tuple(sorted(spec.apps)))
+            for spec in specs
+        )
+        
+        if settings.container_warm_pool_size > 0:
+            for spec in specs:
+                key = self._warm_pool_key(spec)
+                self._warm_specs[key] = spec
+                self._warm_pool[key] = deque()
+                self._schedule_warm_refill(key)
+    
+    async def _ensure_prebuilt_image(self, base_image: str, apps: Tuple[str, ...]):
+        """Build (or reuse) an image with the display stack and apps preinstalled"""
+        dockerfile = _prebuilt_dockerfile(base_image, apps)
+        # Content-addressed tag: dockerd's image store doubles as the cache across restarts
+        tag = f"{PREBUILT_IMAGE_REPO}:{hashlib.sha256(dockerfile.encode()).hexdigest()[:16]}"
+        
+        try:
+            try:
+                await self._docker_call(self.docker_client.images.get, tag)
+            except self._docker_errors.ImageNotFound:
+                logger.info(f"Building prebuilt image {tag} for {base_image} with apps {list(apps)}")
+                await self._docker_call(
+                    self.docker_client.images.build,
+                    fileobj=io.BytesIO(dockerfile.encode()), tag=tag, rm=True
+                )
+            
+            self._prebuilt_images[(base_image, apps)] = tag
+            logger.info(f"Prebuilt image {tag} ready")
+        except Exception as e:
+            logger.warning(f"Failed to prepare prebuilt image for {base_image}: {str(e)}")
+    
+    def _warm_pool_key(self, spec: EnvironmentSpec) -> Tuple:
+        """Key identifying specs that produce interchangeable containers"""
+        return (spec.base_os, tuple(sorted(spec.apps)), spec.network_mode, spec.memory_mb, spec.cpu_cores)
+    
+    def _schedule_warm_refill(self, key: Tuple):
+        """Top up a warm pool in the background unless a refill is already running"""
+        task = self._refill_tasks.get(key)
+        if task is None or task.done():
+            self._refill_tasks[key] = asyncio.create_task(self._refill_warm_pool(key))
+    
+    async def _refill_warm_pool(self, key: Tuple):
+        """Pre-start containers until the warm pool for key reaches its target size"""
+        spec = self._warm_specs[key]
+        pool = self._warm_pool[key]
+        
+        while len(pool) < settings.container_warm_pool_size:
+            container_id = f"genos-warm-{uuid.uuid4().hex[:8]}"
+            try:
+                container = await self._build_container(container_id, None, spec, {})
+                await self._docker_call(container["docker_obj"].start)
+                self._set_status(container_id, "warm")
+                pool.append(container_id)
+                logger.info(f"Warm container {container_id} ready")
+            except Exception as e:
+                logger.warning(f"Failed to pre-start warm container {container_id}: {str(e)}")
+                if container_id in self.containers:
+                    try:
+                        await self.destroy_container(container_id)
+                    except Exception:
+                        pass
+                else:
+                    await self._release_streaming_port(container_id)
+                return
+    
     async def start_container(self, container_id: str) -> bool:
         """Start a container"""
         if container_id not in self.containers:
@@ -117,27 +407,23 @@ class ContainerManager:
         logger.info(f"Starting container {container_id}")
         
         try:
-            # Get Docker container
-            docker_container = self.docker_client.containers.get(container["docker_id"])
+            docker_container = container["docker_obj"]
             
             # Start container
-            docker_container.start()
+            await self._docker_call(docker_container.start)
             
             # Wait for container to be ready
             await self._wait_for_container_ready(container_id)
             
-            # Set up X11 forwarding for GUI applications
-            await self._setup_x11_forwarding(container_id)
-            
-            container["status"] = "running"
-            container["started_at"] = asyncio.get_event_loop().time()
+            self._set_status(container_id, "running")
+            container["started_at"] = time.monotonic()
             
             logger.info(f"Container {container_id} started successfully")
             return True
             
         except Exception as e:
             logger.error(f"Failed to start container {container_id}: {str(e)}")
-            container["status"] = "error"
+            self._set_status(container_id, "error")
             raise
     
     async def stop_container(self, container_id: str) -> bool:
@@ -154,14 +440,13 @@ class ContainerManager:
         logger.info(f"Stopping container {container_id}")
         
         try:
-            # Get Docker container
-            docker_container = self.docker_client.containers.get(container["docker_id"])
+            docker_container = container["docker_obj"]
             
             # Stop container gracefully
-            docker_container.stop(timeout=10)
+            await self._docker_call(docker_container.stop, timeout=10)
             
-            container["status"] = "stopped"
-            container["stopped_at"] = asyncio.get_event_loop().time()
+            self._set_status(container_id, "stopped")
+            container["stopped_at"] = time.monotonic()
             
             logger.info(f"Container {container_id} stopped successfully")
             return True
@@ -184,17 +469,25 @@ class ContainerManager:
             if container["status"] == "running":
                 await self.stop_container(container_id)
             
-            # Get Docker container
-            docker_container = self.docker_client.containers.get(container["docker_id"])
+            docker_container = container["docker_obj"]
             
             # Remove container
-            docker_container.remove(force=True)
+            await self._docker_call(docker_container.remove, force=True)
             
             # Release streaming port
-            self._release_streaming_port(container_id)
+            await self._release_streaming_port(container_id)
+            self._ready_events.pop(container["docker_id"], None)
             
             # Remove container record
             del self.containers[container_id]
+            del self._container_status[container_id]
+            del self._container_created[container_id]
+            del self._by_docker_id[container["docker_id"]]
+            env_containers = self._env_index.get(container["env_id"])
+            if env_containers is not None:
+                env_containers.discard(container_id)
+                if not env_containers:
+                    del self._env_index[container["env_id"]]
             
             logger.info(f"Container {container_id} destroyed successfully")
             return True
@@ -209,10 +502,10 @@ class ContainerManager:
             return self.containers[container_id]["config"].get("streaming_port")
         return None
     
-    async def get_container_status(self, container_id: str) -> Optional[Dict]:
-        """Get container status"""
+    async def get_container_status(self, container_id: str) -> Optional[Mapping[str, Any]]:
+        """Get a read-only view of the container status"""
         if container_id in self.containers:
-            return self.containers[container_id].copy()
+            return MappingProxyType(self.containers[container_id])
         return None
     
     async def _initialize_base_images(self):
@@ -226,26 +519,28 @@ class ContainerManager:
             "alpine:latest"
         ]
         
-        for image in base_images:
-            try:
-                logger.info(f"Pulling base image: {image}")
-                # In a real implementation, we'd pull the image
-                # self.docker_client.images.pull(image)
-                logger.info(f"Base image {image} ready")
-            except Exception as e:
-                logger.warning(f"Failed to pull image {image}: {str(e)}")
+        await self._gather_bounded(self._initialize_base_image(image) for image in base_images)
+    
+    async def _initialize_base_image(self, image: str):
+        """Make a single base image available"""
+        try:
+            logger.info(f"Pulling base image: {image}")
+            # In a real implementation, we'd pull the image
+            # await self._docker_call(self.docker_client.images.pull, image)
+            logger.info(f"Base image {image} ready")
+        except Exception as e:
+            logger.warning(f"Failed to pull image {image}: {str(e)}")
     
-    async def _create_container_config(self, container_id: str, spec: EnvironmentSpec, security_config: Dict) -> Dict:
+    async def _create_container_config(self, container_id: str, spec: EnvironmentSpec, security_config: Dict,
+                                       streaming_port: int) -> Dict:
         """Create container configuration"""
-        # Map OS specification to Docker image
-        image_map = {
-            "ubuntu_22.04": "ubuntu:22.04",
-            "ubuntu_20.04": "ubuntu:20.04",
-            "fedora_38": "fedora:38",
-            "alpine_latest": "alpine:latest"
-        }
-        
-        base_image = image_map.get(spec.base_os, "ubuntu:22.04")
+        # Map OS specification to Docker image, preferring one with apps already baked in
+        base_image = IMAGE_MAP.get(spec.base_os, "ubuntu:22.04")
+        prebuilt_image = self._prebuilt_images.get((base_image, tuple(sorted(spec.apps))))
+        if prebuilt_image:
+            image, command = prebuilt_image, list(PREBUILT_STARTUP_COMMAND)
+        else:
+            image, command = base_image, self._generate_startup_command(spec)
         
         # Create environment variables
         env_vars = {
@@ -258,10 +553,8 @@ class ContainerManager:
             "/tmp/.X11-unix": {"bind": "/tmp/.X11-unix", "mode": "rw"}
         }
         
-        # Create port mappings
-        ports = {}
-        if "streaming_port" in locals():
-            ports["5901/tcp"] = streaming_port
+        # Expose the in-container VNC server on the allocated streaming port
+        ports = {"5901/tcp": streaming_port}
         
         # Create network configuration
         network_mode = "bridge"
@@ -272,11 +565,12 @@ class ContainerManager:
         
         config = {
             "container_id": container_id,
-            "image": base_image,
-            "command": self._generate_startup_command(spec),
+            "image": image,
+            "command": command,
             "environment": env_vars,
             "volumes": volumes,
             "ports": ports,
+            "streaming_port": streaming_port,
             "network_mode": network_mode,
             "memory_limit": f"{spec.memory_mb}m",
             "cpu_quota": int(spec.cpu_cores * 100000),  # CPU quota in microseconds
@@ -289,139 +583,141 @@ class ContainerManager:
     
     def _generate_startup_command(self, spec: EnvironmentSpec) -> List[str]:
         """Generate startup command for container"""
-        commands = [
-            "bash", "-c",
-            " && ".join([
-                "apt-get update",
-                "apt-get install -y xvfb x11vnc supervisor",
-                "mkdir -p /var/log/supervisor",
-                self._generate_app_install_commands(spec.apps),
-                "Xvfb :1 -screen 0 1024x768x16 &",
-                "x11vnc -display :1 -nopw -listen localhost -xkb -rfbport 5901 &",
-                "sleep infinity"
-            ])
-        ]
-        
-        return commands
+        return list(_startup_command(tuple(sorted(spec.apps))))
     
     def _generate_app_install_commands(self, apps: List[str]) -> str:
         """Generate commands to install applications"""
-        install_commands = []
-        
-        app_packages = {
-            "firefox": "apt-get install -y firefox",
-            "chrome": "wget -q -O - https://dl.google.com/linux/linux_signing_key.pub | apt-key add - && echo 'deb [arch=amd64] http://dl.google.com/linux/chrome/deb/ stable main' > /etc/apt/sources.list.d/google-chrome.list && apt-get update && apt-get install -y google-chrome-stable",
-            "tor_browser": "apt-get install -y tor torbrowser-launcher",
-            "vscode": "wget -qO- https://packages.microsoft.com/keys/microsoft.asc | gpg --dearmor > packages.microsoft.gpg && install -o root -g root -m 644 packages.microsoft.gpg /etc/apt/trusted.gpg.d/ && echo 'deb [arch=amd64,arm64,armhf signed-by=/etc/apt/trusted.gpg.d/packages.microsoft.gpg] https://packages.microsoft.com/repos/code stable main' > /etc/apt/sources.list.d/vscode.list && apt-get update && apt-get install -y code",
-            "python": "apt-get install -y python3 python3-pip",
-            "nodejs": "curl -fsSL https://deb.nodesource.com/setup_18.x | bash - && apt-get install -y nodejs",
-            "git": "apt-get install -y git",
-            "terminal": "apt-get install -y gnome-terminal",
-            "office": "apt-get install -y libreoffice",
-            "gimp": "apt-get install -y gimp",
-            "vlc": "apt-get install -y vlc"
-        }
-        
-        for app in apps:
-            if app in app_packages:
-                install_commands.append(app_packages[app])
-        
-        return " && ".join(install_commands) if install_commands else "echo 'No apps to install'"
+        return _app_install_commands(tuple(sorted(apps)))
     
     async def _create_docker_container(self, container_id: str, config: Dict):
         """Create Docker container"""
+        create_kwargs = {
+            "image": config["image"],
+            "command": config["command"],
+            "environment": config["environment"],
+            "volumes": config["volumes"],
+            "ports": config["ports"],
+            "network_mode": config["network_mode"],
+            "mem_limit": config["memory_limit"],
+            "cpu_quota": config["cpu_quota"],
+            "cpu_period": config["cpu_period"],
+            "name": container_id,
+            "detach": True,
+            "tty": True,
+            "stdin_open": True
+        }
+        
         try:
-            container = self.docker_client.containers.create(
-                image=config["image"],
-                command=config["command"],
-                environment=config["environment"],
-                volumes=config["volumes"],
-                ports=config["ports"],
-                network_mode=config["network_mode"],
-                mem_limit=config["memory_limit"],
-                cpu_quota=config["cpu_quota"],
-                cpu_period=config["cpu_period"],
-                name=container_id,
-                detach=True,
-                tty=True,
-                stdin_open=True
-            )
+            return await self._docker_call(self.docker_client.containers.create, **create_kwargs)
             
-            return container
-            
-        except docker.errors.ImageNotFound:
+        except self._docker_errors.ImageNotFound:
             # Pull image and retry
             logger.info(f"Pulling image: {config['image']}")
-            self.docker_client.images.pull(config["image"])
+            await self._docker_call(self.docker_client.images.pull, config["image"])
             
-            return self.docker_client.containers.create(
-                image=config["image"],
-                command=config["command"],
-                environment=config["environment"],
-                volumes=config["volumes"],
-                ports=config["ports"],
-                network_mode=config["network_mode"],
-                mem_limit=config["memory_limit"],
-                cpu_quota=config["cpu_quota"],
-                cpu_period=config["cpu_period"],
-                name=container_id,
-                detach=True,
-                tty=True,
-                stdin_open=True
-            )
+            return await self._docker_call(self.docker_client.containers.create, **create_kwargs)
     
-    def _allocate_streaming_port(self, container_id: str) -> int:
-        """Allocate a streaming port for a container"""
-        for port in self.streaming_port_pool:
-            if port not in self.allocated_ports.values():
-                self.allocated_ports[container_id] = port
-                return port
+    async def _docker_call(self, fn, *args, **kwargs):
+        """Run a blocking docker-py call on the docker thread pool, retrying once if dockerd dropped the connection"""
+        loop = asyncio.get_running_loop()
+        call = partial(fn, *args, **kwargs)
+        try:
+            return await loop.run_in_executor(self._docker_pool, call)
+        except self._docker_connection_errors as e:
+            logger.warning(f"Docker connection lost, retrying: {str(e)}")
+            return await loop.run_in_executor(self._docker_pool, call)
+    
+    async def _gather_bounded(self, coros) -> List[Any]:
+        """Run coroutines concurrently with at most DOCKER_BATCH_CONCURRENCY in flight"""
+        semaphore = asyncio.Semaphore(DOCKER_BATCH_CONCURRENCY)
         
-        raise RuntimeError("No available streaming ports")
+        async def run(coro):
+            async with semaphore:
+                return await coro
+        
+        return await asyncio.gather(*(run(coro) for coro in coros), return_exceptions=True)
+    
+    async def _allocate_streaming_port(self, container_id: str) -> int:
+        """Allocate a streaming port for a container"""
+        # The registry flocks a file and probes sockets, so it runs off the event loop,
+        # drawing candidates from the free set as it goes
+        drawn: List[int] = []
+        port = await asyncio.to_thread(self._port_registry.reserve, container_id, self._draw_free_ports(drawn))
+        
+        # Ports another manager process holds were skipped by the registry; they stay free here
+        self._free_ports.update(p for p in drawn if p != port)
+        if port is None:
+            raise RuntimeError("No available streaming ports")
+        
+        self.allocated_ports[container_id] = port
+        return port
+    
+    def _draw_free_ports(self, drawn: List[int]) -> Iterator[int]:
+        """Pop free ports one at a time, recording each; set.pop is atomic across threads"""
+        while True:
+            try:
+                port = self._free_ports.pop()
+            except KeyError:
+                return
+            drawn.append(port)
+            yield port
     
-    def _release_streaming_port(self, container_id: str):
+    async def _release_streaming_port(self, container_id: str):
         """Release a streaming port"""
         if container_id in self.allocated_ports:
-            del self.allocated_ports[container_id]
+            port = self.allocated_ports.pop(container_id)
+            await asyncio.to_thread(self._port_registry.release, port)
+            self._free_ports.add(port)
     
     async def _wait_for_container_ready(self, container_id: str, timeout: int = 30):
         """Wait for container to be ready"""
         logger.info(f"Waiting for container {container_id} to be ready")
         
         container = self.containers[container_id]
-        docker_container = self.docker_client.containers.get(container["docker_id"])
-        
-        start_time = asyncio.get_event_loop().time()
+        ready = self._ready_events[container["docker_id"]]
+        docker_container = container["docker_obj"]
+        deadline = time.monotonic() + timeout
         
-        while asyncio.get_event_loop().time() - start_time < timeout:
-            # Check if container is running
-            docker_container.reload()
-            if docker_container.status == "running":
-                logger.info(f"Container {container_id} is ready")
-                return
+        while not ready.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"Container {container_id} did not become ready within {timeout} seconds")
             
-            await asyncio.sleep(1)
+            # Once the events stream has died nothing will set the event, so poll instead
+            stream_alive = self._events_task is not None and not self._events_task.done()
+            try:
+                await asyncio.wait_for(ready.wait(), remaining if stream_alive else min(remaining, READY_POLL_INTERVAL))
+            except asyncio.TimeoutError:
+                await self._docker_call(docker_container.reload)
+                if docker_container.status == "running":
+                    ready.set()
         
-        raise TimeoutError(f"Container {container_id} did not become ready within {timeout} seconds")
+        logger.info(f"Container {container_id} is ready")
     
-    async def _setup_x11_forwarding(self, container_id: str):
-        """Set up X11 forwarding for GUI applications"""
-        logger.info(f"Setting up X11 forwarding for container {container_id}")
-        
-        container = self.containers[container_id]
-        docker_container = self.docker_client.containers.get(container["docker_id"])
-        
+    def _consume_docker_events(self, loop: asyncio.AbstractEventLoop):
+        """Forward docker container events to the event loop (runs in a worker thread)"""
         try:
-            # Start Xvfb and VNC server inside container
-            exec_result = docker_container.exec_run(
-                "bash -c 'Xvfb :1 -screen 0 1024x768x16 & x11vnc -display :1 -nopw -listen localhost -xkb -rfbport 5901 &'",
-                detach=True
-            )
-            
-            logger.info(f"X11 forwarding set up for container {container_id}")
-            
+            for event in self._events_stream:
+                loop.call_soon_threadsafe(self._handle_docker_event, event)
         except Exception as e:
-            logger.warning(f"Failed to set up X11 forwarding for container {container_id}: {str(e)}")
+            logger.warning(f"Docker events stream closed: {str(e)}")
+    
+    def _handle_docker_event(self, event: Dict[str, Any]):
+        """Apply a docker container event to the matching container record"""
+        docker_id = event.get("id")
+        ready = self._ready_events.get(docker_id)
+        if ready is None:
+            return
+        
+        action = event.get("Action") or event.get("status")
+        if action == "start":
+            ready.set()
+        elif action == "die":
+            ready.clear()
+            container_id = self._by_docker_id.get(docker_id)
+            if container_id is not None and self._container_status[container_id] == "running":
+                self._set_status(container_id, "stopped")
+                self.containers[container_id]["stopped_at"] = time.monotonic()
     
     async def execute_command(self, container_id: str, command: str) -> Dict[str, Any]:
         """Execute a command in a container"""
@@ -429,17 +725,49 @@ class ContainerManager:
             raise ValueError(f"Container {container_id} not found")
         
         container = self.containers[container_id]
-        docker_container = self.docker_client.containers.get(container["docker_id"])
         
         try:
-            exec_result = docker_container.exec_run(command)
+            exec_id = await self._exec_create(container, command)
+            output = "".join([text async for text in self._iter_exec_output(exec_id)])
+            exec_info = await self._docker_call(self.docker_client.api.exec_inspect, exec_id)
             
             return {
-                "exit_code": exec_result.exit_code,
-                "output": exec_result.output.decode("utf-8")
+                "exit_code": exec_info["ExitCode"],
+                "output": output
             }
             
         except Exception as e:
             logger.error(f"Failed to execute command in container {container_id}: {str(e)}")
             raise
-
+    
+    async def stream_command(self, container_id: str, command: str) -> AsyncIterator[str]:
+        """Execute a command in a container, yielding decoded output as it arrives"""
+        if container_id not in self.containers:
+            raise ValueError(f"Container {container_id} not found")
+        
+        exec_id = await self._exec_create(self.containers[container_id], command)
+        async for text in self._iter_exec_output(exec_id):
+            yield text
+    
+    async def _exec_create(self, container: Dict, command: str) -> str:
+        """Create an exec instance in a container"""
+        exec_info = await self._docker_call(self.docker_client.api.exec_create, container["docker_id"], command)
+        return exec_info["Id"]
+    
+    async def _iter_exec_output(self, exec_id: str) -> AsyncIterator[str]:
+        """Start an exec instance and yield its output chunk by chunk"""
+        chunks = await self._docker_call(self.docker_client.api.exec_start, exec_id, stream=True)
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        
+        try:
+            # Pull one chunk per thread hop so only a single chunk is buffered at a time
+            while (chunk := await self._docker_call(next, chunks, None)) is not None:
+                text = decoder.decode(chunk)
+                if text:
+                    yield text
+            
+            tail = decoder.decode(b"", final=True)
+            if tail:
+                yield tail
+        finally:
+            chunks.close()
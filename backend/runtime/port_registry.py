@@ -0,0 +1,105 @@
+"""
+Port Registry for GenOS
+Shares streaming port reservations between manager processes via a file-locked JSON map
+"""
+
+import errno
+import fcntl
+import json
+import os
+import socket
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, Optional
+
+from ..api.core.logging import get_logger
+
+logger = get_logger(__name__)
+
+class PortRegistry:
+    """Cross-process streaming port reservations"""
+    
+    def __init__(self, path: str, ttl_seconds: int = 7 * 24 * 3600):
+        self.path = Path(path)
+        self.ttl_seconds = ttl_seconds
+    
+    def reserve(self, owner: str, candidates: Iterable[int]) -> Optional[int]:
+        """Reserve the first candidate port not held by any process and free on the host"""
+        try:
+            with self._locked_state() as state:
+                self._reap(state)
+                for port in candidates:
+                    if str(port) in state or not self._is_bindable(port):
+                        continue
+                    state[str(port)] = {
+                        "owner": owner,
+                        "pid": os.getpid(),
+                        "expires_at": time.time() + self.ttl_seconds
+                    }
+                    return port
+                return None
+        except OSError as e:
+            # A port handed out without a record could go to another caller too, so fail instead
+            logger.error(f"Port registry {self.path} unavailable: {str(e)}")
+            return None
+    
+    def release(self, port: int):
+        """Drop a port reservation"""
+        try:
+            with self._locked_state() as state:
+                state.pop(str(port), None)
+        except OSError as e:
+            logger.warning(f"Failed to release port {port} in registry {self.path}: {str(e)}")
+    
+    @contextmanager
+    def _locked_state(self) -> Iterator[Dict[str, Dict]]:
+        """Open the registry under an exclusive lock and write back any changes"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                content = f.read()
+                try:
+                    state = json.loads(content) if content else {}
+                except json.JSONDecodeError:
+                    logger.warning(f"Port registry {self.path} is corrupt, resetting")
+                    state = {}
+                
+                yield state
+                
+                f.seek(0)
+                f.truncate()
+                json.dump(state, f)
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+    
+    def _reap(self, state: Dict[str, Dict]):
+        """Drop reservations that expired or whose owning process is gone"""
+        now = time.time()
+        for port, entry in list(state.items()):
+            if entry.get("expires_at", 0) < now or not self._pid_alive(entry.get("pid")):
+                del state[port]
+    
+    @staticmethod
+    def _pid_alive(pid: Optional[int]) -> bool:
+        """Check whether a process exists"""
+        if not pid:
+            return False
+        try:
+            os.kill(pid, 0)
+        except OSError as e:
+            return e.errno == errno.EPERM
+        return True
+    
+    @staticmethod
+    def _is_bindable(port: int) -> bool:
+        """Probe that nothing on the host is already listening on the port"""
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            try:
+                s.bind(("0.0.0.0", port))
+            except OSError:
+                return False
+        return True
@@ -4,13 +4,21 @@ Manages KVM/QEMU virtual machines and Firecracker microVMs
 """
 
 import asyncio
+import errno
+import hashlib
 import subprocess
-import json
 import os
+import shutil
+import signal
 import uuid
-from typing import Dict, List, Optional, Any
+from dataclasses import dataclass
+from enum import Enum
+from typing import Dict, List, Optional, Any, Tuple
 from pathlib import Path
 import xml.etree.ElementTree as ET
+import aiofiles
+import httpx
+import orjson
 
 from ..api.models.schemas import EnvironmentSpec, NetworkMode
 from ..api.core.config import settings
@@ -18,18 +26,80 @@ from ..api.core.logging import get_logger
 
 logger = get_logger(__name__)
 
+# First bytes of every qcow2 image
+QCOW2_MAGIC = b"QFI\xfb"
+
+# Base VM images by OS, with their download URL and local filename
+BASE_IMAGES = {
+    "ubuntu_22.04": {
+        "url": "https://cloud-images.ubuntu.com/focal/current/focal-server-cloudimg-amd64.img",
+        "filename": "ubuntu-22.04-server-cloudimg-amd64.img"
+    },
+    "ubuntu_20.04": {
+        "url": "https://cloud-images.ubuntu.com/focal/current/focal-server-cloudimg-amd64.img",
+        "filename": "ubuntu-20.04-server-cloudimg-amd64.img"
+    },
+    "fedora_38": {
+        "url": "https://download.fedoraproject.org/pub/fedora/linux/releases/38/Cloud/x86_64/images/Fedora-Cloud-Base-38-1.6.x86_64.qcow2",
+        "filename": "fedora-38-cloud-base.qcow2"
+    }
+}
+
+# OS whose image backs specs naming an unknown base OS
+DEFAULT_BASE_OS = "ubuntu_22.04"
+
+# QEMU argv with per-VM slots filled from the VM config at start
+QEMU_ARGV_TEMPLATE = (
+    "qemu-system-x86_64",
+    "-machine", "{machine_type}",
+    "-accel", "{accel}",
+    "-m", "{memory_mb}",
+    "-smp", "{cpu_cores}",
+    "-drive", "file={disk_path},format={disk_format},if=virtio",
+    "-netdev", "user,id=net0",
+    "-device", "virtio-net-pci,netdev=net0",
+    "-spice", "port={streaming_port},addr=0.0.0.0,disable-ticketing",
+    "-display", "spice-app",
+    "-qmp", "unix:{qmp_socket_path},server,nowait"
+)
+
+class VMStatus(str, Enum):
+    CREATED = "created"
+    RUNNING = "running"
+    STOPPED = "stopped"
+    ERROR = "error"
+
+@dataclass(slots=True)
+class VMRecord:
+    """Tracked state of a managed VM"""
+    id: str
+    env_id: str
+    type: str
+    config: Dict[str, Any]
+    status: VMStatus = VMStatus.CREATED
+    pid: Optional[int] = None
+    created_at: float = 0
+    started_at: float = 0
+    stopped_at: float = 0
+
 class VMManager:
     """Manages virtual machines using KVM/QEMU and Firecracker"""
     
     def __init__(self):
-        self.vms: Dict[str, Dict] = {}
+        self.vms: Dict[str, VMRecord] = {}
         self.base_images_path = Path(settings.vm_images_path)
         self.vm_storage_path = Path(settings.vm_storage_path)
-        self.streaming_port_pool = list(range(
+        self._free_ports: set[int] = set(range(
             settings.streaming_port_range_start,
             settings.streaming_port_range_end + 1
         ))
         self.allocated_ports: Dict[str, int] = {}
+        # pidfd lets us sleep on process exit instead of polling (Linux 5.3+, Python 3.9+)
+        self._pidfd_supported = hasattr(os, "pidfd_open")
+        self._kvm_available = False
+        self._reflink_supported = False
+        # Firecracker API clients by socket path, kept open for the VM's lifetime
+        self._fc_clients: Dict[str, httpx.AsyncClient] = {}
     
     async def initialize(self):
         """Initialize the VM manager"""
@@ -39,10 +109,16 @@ class VMManager:
         self.base_images_path.mkdir(parents=True, exist_ok=True)
         self.vm_storage_path.mkdir(parents=True, exist_ok=True)
         
-        # Check KVM availability
-        if not await self._check_kvm_support():
+        # Check KVM availability once; it doesn't change while we run
+        self._kvm_available = self._check_kvm_support()
+        if not self._kvm_available:
             logger.warning("KVM support not available, VMs will run in emulation mode")
         
+        # Check whether VM storage can share extents with reflink copies
+        self._reflink_supported = await self._check_reflink_support()
+        if self._reflink_supported:
+            logger.info("Reflink copies supported, raw VM disks will be cloned from base images")
+        
         # Check QEMU availability
         if not await self._check_qemu_availability():
             logger.error("QEMU not available, VM functionality will be limited")
@@ -56,12 +132,15 @@ class VMManager:
         """Cleanup VM manager resources"""
         logger.info("Cleaning up VM manager")
         
-        # Stop all running VMs
-        for vm_id in list(self.vms.keys()):
-            try:
-                await self.destroy_vm(vm_id)
-            except Exception as e:
-                logger.error(f"Error destroying VM {vm_id}: {str(e)}")
+        # Stop all running VMs concurrently; total time is the slowest shutdown
+        vm_ids = list(self.vms)
+        results = await asyncio.gather(
+            *(self.destroy_vm(vm_id) for vm_id in vm_ids),
+            return_exceptions=True
+        )
+        for vm_id, result in zip(vm_ids, results):
+            if isinstance(result, Exception):
+                logger.error(f"Error destroying VM {vm_id}: {str(result)}")
         
         logger.info("VM manager cleanup completed")
     
@@ -82,23 +161,22 @@ class VMManager:
             vm_config = await self._create_vm_config(vm_id, spec, security_config, vm_type)
             
             # Create VM disk image
-            disk_path = await self._create_vm_disk(vm_id, spec)
+            disk_path, disk_format = await self._create_vm_disk(vm_id, spec, vm_type)
             vm_config["disk_path"] = str(disk_path)
+            vm_config["disk_format"] = disk_format
             
             # Allocate streaming port
             streaming_port = self._allocate_streaming_port(vm_id)
             vm_config["streaming_port"] = streaming_port
             
             # Store VM configuration
-            self.vms[vm_id] = {
-                "id": vm_id,
-                "env_id": env_id,
-                "type": vm_type,
-                "config": vm_config,
-                "status": "created",
-                "pid": None,
-                "created_at": asyncio.get_event_loop().time()
-            }
+            self.vms[vm_id] = VMRecord(
+                id=vm_id,
+                env_id=env_id,
+                type=vm_type,
+                config=vm_config,
+                created_at=asyncio.get_event_loop().time()
+            )
             
             logger.info(f"VM {vm_id} created successfully")
             return vm_id
@@ -114,21 +192,21 @@ class VMManager:
         
         vm = self.vms[vm_id]
         
-        if vm["status"] == "running":
+        if vm.status is VMStatus.RUNNING:
             logger.warning(f"VM {vm_id} is already running")
             return True
         
         logger.info(f"Starting VM {vm_id}")
         
         try:
-            if vm["type"] == "firecracker":
-                pid = await self._start_firecracker_vm(vm_id, vm["config"])
+            if vm.type == "firecracker":
+                pid = await self._start_firecracker_vm(vm_id, vm.config)
             else:
-                pid = await self._start_qemu_vm(vm_id, vm["config"])
+                pid = await self._start_qemu_vm(vm_id, vm.config)
             
-            vm["pid"] = pid
-            vm["status"] = "running"
-            vm["started_at"] = asyncio.get_event_loop().time()
+            vm.pid = pid
+            vm.status = VMStatus.RUNNING
+            vm.started_at = asyncio.get_event_loop().time()
             
             # Wait for VM to be ready
             await self._wait_for_vm_ready(vm_id)
@@ -138,7 +216,7 @@ class VMManager:
             
         except Exception as e:
             logger.error(f"Failed to start VM {vm_id}: {str(e)}")
-            vm["status"] = "error"
+            vm.status = VMStatus.ERROR
             raise
     
     async def stop_vm(self, vm_id: str) -> bool:
@@ -148,7 +226,7 @@ class VMManager:
         
         vm = self.vms[vm_id]
         
-        if vm["status"] != "running":
+        if vm.status is not VMStatus.RUNNING:
             logger.warning(f"VM {vm_id} is not running")
             return True
         
@@ -156,31 +234,23 @@ class VMManager:
         
         try:
             # Send shutdown signal
-            if vm["pid"]:
-                process = await asyncio.create_subprocess_exec(
-                    "kill", "-TERM", str(vm["pid"]),
-                    stdout=asyncio.subprocess.PIPE,
-                    stderr=asyncio.subprocess.PIPE
-                )
-                await process.wait()
-                
-                # Wait for graceful shutdown
-                await asyncio.sleep(5)
-                
-                # Force kill if still running
+            if vm.pid:
                 try:
-                    process = await asyncio.create_subprocess_exec(
-                        "kill", "-KILL", str(vm["pid"]),
-                        stdout=asyncio.subprocess.PIPE,
-                        stderr=asyncio.subprocess.PIPE
-                    )
-                    await process.wait()
-                except:
+                    os.kill(vm.pid, signal.SIGTERM)
+                    
+                    # Wait for graceful shutdown, force kill if still running
+                    if not await self._wait_for_exit(vm.pid, timeout=5):
+                        os.kill(vm.pid, signal.SIGKILL)
+                except ProcessLookupError:
                     pass  # Process might already be dead
             
-            vm["status"] = "stopped"
-            vm["pid"] = None
-            vm["stopped_at"] = asyncio.get_event_loop().time()
+            # The API socket dies with the process; drop its pooled connection
+            if vm.type == "firecracker":
+                await self._close_firecracker_client(vm.config["socket_path"])
+            
+            vm.status = VMStatus.STOPPED
+            vm.pid = None
+            vm.stopped_at = asyncio.get_event_loop().time()
             
             logger.info(f"VM {vm_id} stopped successfully")
             return True
@@ -200,11 +270,11 @@ class VMManager:
         
         try:
             # Stop VM if running
-            if vm["status"] == "running":
+            if vm.status is VMStatus.RUNNING:
                 await self.stop_vm(vm_id)
             
             # Remove disk image
-            disk_path = Path(vm["config"]["disk_path"])
+            disk_path = Path(vm.config["disk_path"])
             if disk_path.exists():
                 disk_path.unlink()
             
@@ -224,27 +294,48 @@ class VMManager:
     async def get_streaming_port(self, vm_id: str) -> Optional[int]:
         """Get the streaming port for a VM"""
         if vm_id in self.vms:
-            return self.vms[vm_id]["config"].get("streaming_port")
+            return self.vms[vm_id].config.get("streaming_port")
         return None
     
     async def get_vm_status(self, vm_id: str) -> Optional[Dict]:
         """Get VM status"""
-        if vm_id in self.vms:
-            return self.vms[vm_id].copy()
-        return None
+        vm = self.vms.get(vm_id)
+        if vm is None:
+            return None
+        # Snapshot only the lifecycle fields; the config blob stays private
+        return {
+            "id": vm.id,
+            "env_id": vm.env_id,
+            "type": vm.type,
+            "status": vm.status,
+            "pid": vm.pid,
+            "created_at": vm.created_at,
+            "started_at": vm.started_at,
+            "stopped_at": vm.stopped_at
+        }
     
-    async def _check_kvm_support(self) -> bool:
+    def _check_kvm_support(self) -> bool:
         """Check if KVM is available"""
+        return os.access("/dev/kvm", os.R_OK)
+    
+    async def _check_reflink_support(self) -> bool:
+        """Check if the VM storage filesystem supports reflink copies (XFS with reflink, Btrfs)"""
+        probe_src = self.vm_storage_path / f".reflink-probe-{uuid.uuid4().hex[:8]}"
+        probe_dst = probe_src.with_suffix(".copy")
         try:
+            probe_src.write_bytes(b"\0" * 4096)
             process = await asyncio.create_subprocess_exec(
-                "test", "-r", "/dev/kvm",
+                "cp", "--reflink=always", str(probe_src), str(probe_dst),
                 stdout=asyncio.subprocess.PIPE,
                 stderr=asyncio.subprocess.PIPE
             )
             return_code = await process.wait()
             return return_code == 0
-        except:
+        except OSError:
             return False
+        finally:
+            probe_src.unlink(missing_ok=True)
+            probe_dst.unlink(missing_ok=True)
     
     async def _check_qemu_availability(self) -> bool:
         """Check if QEMU is available"""
@@ -263,30 +354,56 @@ class VMManager:
         """Initialize base VM images"""
         logger.info("Initializing base VM images")
         
-        # Define base images
-        base_images = {
-            "ubuntu_22.04": {
-                "url": "https://cloud-images.ubuntu.com/focal/current/focal-server-cloudimg-amd64.img",
-                "filename": "ubuntu-22.04-server-cloudimg-amd64.img"
-            },
-            "ubuntu_20.04": {
-                "url": "https://cloud-images.ubuntu.com/focal/current/focal-server-cloudimg-amd64.img",
-                "filename": "ubuntu-20.04-server-cloudimg-amd64.img"
-            },
-            "fedora_38": {
-                "url": "https://download.fedoraproject.org/pub/fedora/linux/releases/38/Cloud/x86_64/images/Fedora-Cloud-Base-38-1.6.x86_64.qcow2",
-                "filename": "fedora-38-cloud-base.qcow2"
-            }
-        }
+        # Group aliases by URL so identical images are fetched once
+        images_by_url: Dict[str, List[Path]] = {}
+        for image_info in BASE_IMAGES.values():
+            images_by_url.setdefault(image_info["url"], []).append(self.base_images_path / image_info["filename"])
         
-        # Download missing images (in a real implementation)
-        for os_name, image_info in base_images.items():
-            image_path = self.base_images_path / image_info["filename"]
-            if not image_path.exists():
-                logger.info(f"Base image for {os_name} not found, would download from {image_info['url']}")
-                # In a real implementation, download the image
-                # For now, create a placeholder
-                image_path.touch()
+        results = await asyncio.gather(
+            *(self._materialize_base_image(url, aliases) for url, aliases in images_by_url.items()),
+            return_exceptions=True
+        )
+        for url, result in zip(images_by_url, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Failed to prepare base image from {url}: {str(result)}")
+    
+    async def _materialize_base_image(self, url: str, aliases: List[Path]):
+        """Fetch a base image into a content-addressed blob and link its named aliases to it"""
+        missing = [alias for alias in aliases if not alias.exists()]
+        if not missing:
+            return
+        
+        blobs_path = self.base_images_path / "blobs"
+        blobs_path.mkdir(exist_ok=True)
+        blob_path = blobs_path / hashlib.sha256(url.encode()).hexdigest()
+        
+        if not blob_path.exists():
+            if settings.download_base_images:
+                await self._download_image(url, blob_path)
+            else:
+                logger.info(f"Base image {blob_path.name} not found, would download from {url}")
+                # Downloads disabled, create a placeholder
+                blob_path.touch()
+        
+        for alias in missing:
+            if alias.is_symlink():
+                alias.unlink()  # Dangling link from a removed blob
+            alias.symlink_to(blob_path)
+    
+    async def _download_image(self, url: str, dest: Path):
+        """Stream an image to disk, renaming into place only once complete"""
+        logger.info(f"Downloading base image from {url}")
+        partial_path = dest.with_suffix(".part")
+        
+        async with httpx.AsyncClient(follow_redirects=True, timeout=None) as client:
+            async with client.stream("GET", url) as response:
+                response.raise_for_status()
+                async with aiofiles.open(partial_path, "wb") as f:
+                    async for chunk in response.aiter_bytes(1 << 20):
+                        await f.write(chunk)
+        
+        partial_path.rename(dest)
+        logger.info(f"Downloaded base image to {dest}")
     
     async def _create_vm_config(self, vm_id: str, spec: EnvironmentSpec, security_config: Dict, vm_type: str) -> Dict:
         """Create VM configuration"""
@@ -313,23 +430,24 @@ class VMManager:
         else:
             config.update({
                 "machine_type": "q35",
-                "accel": "kvm" if await self._check_kvm_support() else "tcg",
+                "qmp_socket_path": f"/tmp/{vm_id}.qmp",
+                "accel": "kvm" if self._kvm_available else "tcg",
                 "display": "spice-app,gl=on" if spec.gpu_enabled else "spice-app"
             })
         
         return config
     
-    async def _create_vm_disk(self, vm_id: str, spec: EnvironmentSpec) -> Path:
-        """Create VM disk image"""
+    async def _create_vm_disk(self, vm_id: str, spec: EnvironmentSpec, vm_type: str) -> Tuple[Path, str]:
+        """Create VM disk image, returning its path and format"""
         # Determine base image
-        base_image_map = {
-            "ubuntu_22.04": "ubuntu-22.04-server-cloudimg-amd64.img",
-            "ubuntu_20.04": "ubuntu-20.04-server-cloudimg-amd64.img",
-            "fedora_38": "fedora-38-cloud-base.qcow2"
-        }
-        
-        base_image_name = base_image_map.get(spec.base_os, "ubuntu-22.04-server-cloudimg-amd64.img")
+        base_image_name = BASE_IMAGES.get(spec.base_os, BASE_IMAGES[DEFAULT_BASE_OS])["filename"]
         base_image_path = self.base_images_path / base_image_name
+        base_format = self._image_format(base_image_path)
+        
+        # Firecracker only boots raw rootfs images; for QEMU, a raw base on a
+        # reflink-capable filesystem is cloned rather than layered with qcow2
+        if vm_type == "firecracker" or (base_format == "raw" and self._reflink_supported):
+            return await self._create_raw_vm_disk(vm_id, spec, base_image_path, base_format), "raw"
         
         # Create VM-specific disk
         vm_disk_path = self.vm_storage_path / f"{vm_id}.qcow2"
@@ -338,7 +456,7 @@ class VMManager:
         process = await asyncio.create_subprocess_exec(
             "qemu-img", "create", "-f", "qcow2",
             "-b", str(base_image_path),
-            "-F", "qcow2",
+            "-F", base_format,
             str(vm_disk_path),
             f"{spec.disk_gb}G",
             stdout=asyncio.subprocess.PIPE,
@@ -352,38 +470,84 @@ class VMManager:
             raise RuntimeError(f"Failed to create VM disk: {stderr.decode()}")
         
         logger.info(f"Created VM disk: {vm_disk_path}")
+        return vm_disk_path, "qcow2"
+    
+    async def _create_raw_vm_disk(self, vm_id: str, spec: EnvironmentSpec, base_image_path: Path,
+                                  base_format: str) -> Path:
+        """Materialize a sparse raw VM disk from a base image"""
+        vm_disk_path = self.vm_storage_path / f"{vm_id}.raw"
+        
+        if base_format == "qcow2":
+            cmd = ["qemu-img", "convert", "-f", "qcow2", "-O", "raw", str(base_image_path), str(vm_disk_path)]
+        elif self._reflink_supported:
+            cmd = ["cp", "--reflink=always", str(base_image_path), str(vm_disk_path)]
+        else:
+            cmd = None
+        
+        if cmd is not None:
+            process = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+            
+            stdout, stderr = await process.communicate()
+            
+            if process.returncode != 0:
+                if base_format == "qcow2":
+                    logger.error(f"Failed to create VM disk: {stderr.decode()}")
+                    raise RuntimeError(f"Failed to create VM disk: {stderr.decode()}")
+                logger.warning(f"Reflink copy failed, copying base image instead: {stderr.decode()}")
+                cmd = None
+        
+        if cmd is None:
+            await asyncio.to_thread(self._fast_copy, base_image_path, vm_disk_path)
+        
+        # Grow to the requested size; the extension stays sparse
+        disk_size = spec.disk_gb << 30
+        if vm_disk_path.stat().st_size < disk_size:
+            os.truncate(vm_disk_path, disk_size)
+        
+        logger.info(f"Created raw VM disk: {vm_disk_path}")
         return vm_disk_path
     
+    @staticmethod
+    def _fast_copy(src: Path, dst: Path):
+        """Copy a file in-kernel with copy_file_range, falling back to a userspace copy"""
+        try:
+            with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+                while os.copy_file_range(fsrc.fileno(), fdst.fileno(), 1 << 30):
+                    pass
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+                raise
+            shutil.copyfile(src, dst)
+    
+    def _image_format(self, image_path: Path) -> str:
+        """Detect whether an image is qcow2 or raw from its header"""
+        try:
+            with open(image_path, "rb") as f:
+                return "qcow2" if f.read(len(QCOW2_MAGIC)) == QCOW2_MAGIC else "raw"
+        except OSError:
+            return "qcow2"
+    
     def _allocate_streaming_port(self, vm_id: str) -> int:
         """Allocate a streaming port for a VM"""
-        for port in self.streaming_port_pool:
-            if port not in self.allocated_ports.values():
-                self.allocated_ports[vm_id] = port
-                return port
+        if not self._free_ports:
+            raise RuntimeError("No available streaming ports")
         
-        raise RuntimeError("No available streaming ports")
+        port = self._free_ports.pop()
+        self.allocated_ports[vm_id] = port
+        return port
     
     def _release_streaming_port(self, vm_id: str):
         """Release a streaming port"""
         if vm_id in self.allocated_ports:
-            del self.allocated_ports[vm_id]
+            self._free_ports.add(self.allocated_ports.pop(vm_id))
     
     async def _start_qemu_vm(self, vm_id: str, config: Dict) -> int:
         """Start a QEMU VM"""
-        cmd = [
-            "qemu-system-x86_64",
-            "-machine", config["machine_type"],
-            "-accel", config["accel"],
-            "-m", str(config["memory_mb"]),
-            "-smp", str(config["cpu_cores"]),
-            "-drive", f"file={config['disk_path']},format=qcow2,if=virtio",
-            "-netdev", "user,id=net0",
-            "-device", "virtio-net-pci,netdev=net0",
-            "-spice", f"port={config['streaming_port']},addr=0.0.0.0,disable-ticketing",
-            "-display", "spice-app",
-            "-daemonize",
-            "-pidfile", f"/tmp/{vm_id}.pid"
-        ]
+        cmd = [arg.format_map(config) if "{" in arg else arg for arg in QEMU_ARGV_TEMPLATE]
         
         # Add GPU support if enabled
         if config.get("gpu_enabled"):
@@ -391,65 +555,27 @@ class VMManager:
         
         logger.info(f"Starting QEMU VM with command: {' '.join(cmd)}")
         
+        # Run QEMU in the foreground so its PID comes straight from the process
+        # handle; startup failures surface as an early exit in _wait_for_vm_ready
         process = await asyncio.create_subprocess_exec(
             *cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL
         )
         
-        stdout, stderr = await process.communicate()
-        
-        if process.returncode != 0:
-            logger.error(f"Failed to start QEMU VM: {stderr.decode()}")
-            raise RuntimeError(f"Failed to start QEMU VM: {stderr.decode()}")
-        
-        # Read PID from pidfile
-        try:
-            with open(f"/tmp/{vm_id}.pid", "r") as f:
-                pid = int(f.read().strip())
-            return pid
-        except:
-            raise RuntimeError("Failed to get VM PID")
+        return process.pid
     
     async def _start_firecracker_vm(self, vm_id: str, config: Dict) -> int:
         """Start a Firecracker microVM"""
-        # Create Firecracker configuration
-        fc_config = {
-            "boot-source": {
-                "kernel_image_path": config["kernel_path"],
-                "boot_args": "console=ttyS0 reboot=k panic=1 pci=off"
-            },
-            "drives": [
-                {
-                    "drive_id": "rootfs",
-                    "path_on_host": config["disk_path"],
-                    "is_root_device": True,
-                    "is_read_only": False
-                }
-            ],
-            "machine-config": {
-                "vcpu_count": config["cpu_cores"],
-                "mem_size_mib": config["memory_mb"]
-            },
-            "network-interfaces": [
-                {
-                    "iface_id": "eth0",
-                    "guest_mac": "AA:FC:00:00:00:01",
-                    "host_dev_name": "tap0"
-                }
-            ]
-        }
+        socket_path = config["socket_path"]
         
-        # Write configuration file
-        config_path = f"/tmp/{vm_id}-config.json"
-        with open(config_path, "w") as f:
-            json.dump(fc_config, f, indent=2)
+        # Firecracker refuses to bind over a stale socket
+        Path(socket_path).unlink(missing_ok=True)
         
-        # Start Firecracker
+        # Start Firecracker with only its API socket; the VM is configured over HTTP
         cmd = [
             "firecracker",
-            "--api-sock", config["socket_path"],
-            "--config-file", config_path
+            "--api-sock", socket_path
         ]
         
         logger.info(f"Starting Firecracker VM with command: {' '.join(cmd)}")
@@ -460,15 +586,165 @@ class VMManager:
             stderr=asyncio.subprocess.PIPE
         )
         
-        # Firecracker runs in foreground, so we need to handle it differently
-        # In a real implementation, we'd use the API socket to control it
+        try:
+            await asyncio.wait_for(self._wait_for_unix_socket(socket_path), timeout=10)
+            await self._configure_firecracker_vm(config)
+        except Exception:
+            process.kill()
+            await self._close_firecracker_client(socket_path)
+            raise
         
         return process.pid
     
+    async def _configure_firecracker_vm(self, config: Dict):
+        """Configure and boot a Firecracker microVM through its API socket"""
+        requests = [
+            ("/boot-source", {
+                "kernel_image_path": config["kernel_path"],
+                "boot_args": "console=ttyS0 reboot=k panic=1 pci=off"
+            }),
+            ("/drives/rootfs", {
+                "drive_id": "rootfs",
+                "path_on_host": config["disk_path"],
+                "is_root_device": True,
+                "is_read_only": False
+            }),
+            ("/machine-config", {
+                "vcpu_count": config["cpu_cores"],
+                "mem_size_mib": config["memory_mb"]
+            }),
+            ("/network-interfaces/eth0", {
+                "iface_id": "eth0",
+                "guest_mac": "AA:FC:00:00:00:01",
+                "host_dev_name": "tap0"
+            }),
+            ("/actions", {"action_type": "InstanceStart"})
+        ]
+        
+        client = self._firecracker_client(config["socket_path"])
+        for path, body in requests:
+            response = await client.put(
+                path,
+                content=orjson.dumps(body),
+                headers={"Content-Type": "application/json"}
+            )
+            if response.is_error:
+                raise RuntimeError(f"Firecracker API PUT {path} failed: {response.text}")
+    
+    def _firecracker_client(self, socket_path: str) -> httpx.AsyncClient:
+        """Get the pooled API client for a Firecracker socket, creating it on first use"""
+        client = self._fc_clients.get(socket_path)
+        if client is None:
+            transport = httpx.AsyncHTTPTransport(uds=socket_path)
+            client = httpx.AsyncClient(transport=transport, base_url="http://localhost")
+            self._fc_clients[socket_path] = client
+        return client
+    
+    async def _close_firecracker_client(self, socket_path: str):
+        """Close the pooled API client for a Firecracker socket"""
+        client = self._fc_clients.pop(socket_path, None)
+        if client is not None:
+            await client.aclose()
+    
+    async def _wait_for_exit(self, pid: int, timeout: float) -> bool:
+        """Wait up to timeout for a process to exit, returning whether it did"""
+        pidfd = None
+        if self._pidfd_supported:
+            try:
+                pidfd = os.pidfd_open(pid)
+            except ProcessLookupError:
+                return True
+            except OSError as e:
+                logger.debug("pidfd_open failed for PID %s, falling back to polling: %s", pid, e)
+        
+        if pidfd is None:
+            deadline = asyncio.get_running_loop().time() + timeout
+            while asyncio.get_running_loop().time() < deadline:
+                try:
+                    os.kill(pid, 0)
+                except ProcessLookupError:
+                    return True
+                await asyncio.sleep(0.1)
+            return False
+        
+        loop = asyncio.get_running_loop()
+        exited = loop.create_future()
+        loop.add_reader(pidfd, lambda: exited.done() or exited.set_result(None))
+        try:
+            await asyncio.wait_for(exited, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            loop.remove_reader(pidfd)
+            os.close(pidfd)
+    
     async def _wait_for_vm_ready(self, vm_id: str, timeout: int = 60):
         """Wait for VM to be ready"""
         logger.info(f"Waiting for VM {vm_id} to be ready")
         
+        vm = self.vms[vm_id]
+        pidfd = None
+        if self._pidfd_supported and vm.pid:
+            try:
+                pidfd = os.pidfd_open(vm.pid)
+            except OSError as e:
+                logger.debug("pidfd_open failed for VM %s, falling back to polling: %s", vm_id, e)
+        
+        if pidfd is None:
+            await self._poll_vm_ready(vm_id, timeout)
+            return
+        
+        loop = asyncio.get_running_loop()
+        exited = loop.create_future()
+        loop.add_reader(pidfd, lambda: exited.done() or exited.set_result(None))
+        control_ready = asyncio.create_task(self._wait_for_control_socket(vm))
+        
+        try:
+            # Sleep until the control socket accepts connections or the process dies
+            done, _ = await asyncio.wait(
+                {exited, control_ready},
+                timeout=timeout,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            
+            if exited in done:
+                raise RuntimeError(f"VM {vm_id} process exited during startup")
+            if control_ready in done:
+                control_ready.result()
+                logger.info(f"VM {vm_id} is ready")
+                return
+        finally:
+            loop.remove_reader(pidfd)
+            os.close(pidfd)
+            control_ready.cancel()
+        
+        raise TimeoutError(f"VM {vm_id} did not become ready within {timeout} seconds")
+    
+    async def _wait_for_control_socket(self, vm: VMRecord):
+        """Wait until the VM's control socket (Firecracker API or QEMU QMP) accepts connections"""
+        config = vm.config
+        socket_path = config["socket_path"] if vm.type == "firecracker" else config["qmp_socket_path"]
+        await self._wait_for_unix_socket(socket_path)
+    
+    async def _wait_for_unix_socket(self, socket_path: str):
+        """Wait until a unix socket accepts connections"""
+        delay = 0.05
+        
+        while True:
+            try:
+                _, writer = await asyncio.open_unix_connection(socket_path)
+            except OSError:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 1.0)
+                continue
+            
+            writer.close()
+            await writer.wait_closed()
+            return
+    
+    async def _poll_vm_ready(self, vm_id: str, timeout: int):
+        """Poll VM process liveness when pidfds are unavailable"""
         start_time = asyncio.get_event_loop().time()
         
         while asyncio.get_event_loop().time() - start_time < timeout:
@@ -478,21 +754,14 @@ class VMManager:
             
             # Check if VM process is still running
             vm = self.vms[vm_id]
-            if vm["pid"]:
+            if vm.pid:
                 try:
-                    process = await asyncio.create_subprocess_exec(
-                        "kill", "-0", str(vm["pid"]),
-                        stdout=asyncio.subprocess.PIPE,
-                        stderr=asyncio.subprocess.PIPE
-                    )
-                    return_code = await process.wait()
-                    if return_code == 0:
-                        logger.info(f"VM {vm_id} is ready")
-                        return
-                except:
+                    os.kill(vm.pid, 0)
+                    logger.info(f"VM {vm_id} is ready")
+                    return
+                except OSError:
                     pass
             
             await asyncio.sleep(3)
         
         raise TimeoutError(f"VM {vm_id} did not become ready within {timeout} seconds")
-
@@ -4,26 +4,218 @@ Implements comprehensive security and isolation mechanisms
 """
 
 import asyncio
+import copy
 import json
-import uuid
-from typing import Dict, List, Optional, Any
-from pathlib import Path
+from collections import Counter
+from functools import lru_cache
+from itertools import compress
+from operator import not_
+from types import MappingProxyType
+from weakref import WeakValueDictionary
+from typing import Dict, FrozenSet, List, Mapping, NamedTuple, Any, Tuple
 from enum import Enum
 
 from ..api.models.schemas import EnvironmentSpec, NetworkMode
-from ..api.core.config import settings
 from ..api.core.logging import get_logger
 
 logger = get_logger(__name__)
 
-class SecurityLevel(Enum):
+# Apps that always get a high security level
+HIGH_SECURITY_APPS = frozenset({"tor_browser", "vpn", "crypto"})
+
+# Names of the environment security checks, in the order they are gathered
+SECURITY_CHECK_NAMES = (
+    "network_isolation",
+    "filesystem_isolation",
+    "capability_restrictions",
+    "resource_limits",
+    "audit_logging"
+)
+
+# Shared results for passing checks; failures build their own result
+CHECK_OK = {
+    name: MappingProxyType({"passed": True, "details": details})
+    for name, details in zip(SECURITY_CHECK_NAMES, (
+        "Network isolation verified",
+        "Filesystem isolation verified",
+        "Capability restrictions verified",
+        "Resource limits verified",
+        "Audit logging verified"
+    ))
+}
+
+# Distinct specs whose generated security configs are kept
+SECURITY_CONFIG_CACHE_SIZE = 512
+
+# Policy templates shared by every generated security config; builders copy
+# them shallowly and only swap in per-spec values
+NETWORK_POLICY_BASE = {
+    "allowed_protocols": (),
+    "blocked_domains": (),
+    "firewall_rules": (),
+    "dns_filtering": False,
+    "vpn_required": False
+}
+
+BLOCKED_DOMAINS = ("facebook.com", "twitter.com", "social-media.com")
+
+# Marks the end of a blocked domain in a domain trie
+DOMAIN_TRIE_END = "$"
+
+def _build_domain_trie(domains: Tuple[str, ...]) -> Dict[str, Any]:
+    """Build a trie over reversed domain labels, e.g. com -> facebook -> $"""
+    trie: Dict[str, Any] = {}
+    for domain in domains:
+        node = trie
+        for label in reversed(domain.lower().split(".")):
+            node = node.setdefault(label, {})
+        node[DOMAIN_TRIE_END] = True
+    return trie
+
+def _trie_has_domain(domain: str, trie: Dict[str, Any]) -> bool:
+    """Check whether a domain or any parent domain is in a domain trie"""
+    node = trie
+    for label in reversed(domain.lower().rstrip(".").split(".")):
+        node = node.get(label)
+        if node is None:
+            return False
+        if DOMAIN_TRIE_END in node:
+            return True
+    return False
+
+FIREWALL_RULES_LIMITED = (
+    {"action": "allow", "protocol": "tcp", "port": 443},
+    {"action": "allow", "protocol": "udp", "port": 53},
+    {"action": "deny", "protocol": "*", "port": "*"}
+)
+
+def _rule_key(rule: Dict[str, Any]) -> str:
+    """Stable identifier for a firewall rule"""
+    return f"{rule['action']}:{rule['protocol']}:{rule['port']}"
+
+def _subsumes(rule: Dict[str, Any], other: Dict[str, Any]) -> bool:
+    """Whether rule matches every packet other matches"""
+    return rule["protocol"] in ("*", other["protocol"]) and rule["port"] in ("*", other["port"])
+
+def _dedupe_firewall_rules(rules: Tuple[Dict[str, Any], ...]) -> Tuple[Dict[str, Any], ...]:
+    """Drop rules that can never match because an earlier rule subsumes them"""
+    emitted: List[Dict[str, Any]] = []
+    for rule in rules:
+        if not any(_subsumes(earlier, rule) for earlier in emitted):
+            emitted.append(rule)
+    return tuple(emitted)
+
+NETWORK_MODE_POLICIES = {
+    NetworkMode.ISOLATED: {
+        "mode": NetworkMode.ISOLATED.value,
+        **NETWORK_POLICY_BASE,
+        "internet_access": False,
+        "local_network_access": False
+    },
+    NetworkMode.LIMITED: {
+        "mode": NetworkMode.LIMITED.value,
+        **NETWORK_POLICY_BASE,
+        "allowed_protocols": ("https", "dns"),
+        "blocked_domains": BLOCKED_DOMAINS,
+        "dns_filtering": True,
+        "firewall_rules": FIREWALL_RULES_LIMITED,
+        "internet_access": True,
+        "local_network_access": False,
+        "content_filtering": True
+    },
+    NetworkMode.FULL: {
+        "mode": NetworkMode.FULL.value,
+        **NETWORK_POLICY_BASE,
+        "allowed_protocols": ("*",),
+        "internet_access": True,
+        "local_network_access": True
+    }
+}
+
+TOR_NETWORK_POLICY = {
+    "tor_required": True,
+    "direct_connections_blocked": True,
+    "dns_over_tor": True
+}
+
+BASE_ALLOWED_PATHS = ("/home/user", "/tmp", "/var/tmp")
+
+DEVELOPMENT_ALLOWED_PATHS = BASE_ALLOWED_PATHS + ("/usr/local", "/opt")
+
+FILESYSTEM_POLICY_BASE = {
+    "read_only_system": True,
+    "isolated_home": True,
+    "temp_filesystem": True,
+    "encrypted_storage": True,
+    "mount_restrictions": (),
+    "file_permissions": "strict",
+    "allowed_paths": BASE_ALLOWED_PATHS,
+    "blocked_paths": ("/etc/passwd", "/etc/shadow", "/root", "/boot")
+}
+
+# Default minimal capabilities
+ALLOWED_CAPABILITIES = ("CAP_CHOWN", "CAP_DAC_OVERRIDE", "CAP_FOWNER", "CAP_SETGID", "CAP_SETUID")
+
+BLOCKED_CAPABILITIES = (
+    "CAP_SYS_ADMIN",
+    "CAP_SYS_MODULE",
+    "CAP_SYS_RAWIO",
+    "CAP_SYS_BOOT",
+    "CAP_SYS_TIME",
+    "CAP_NET_ADMIN",
+    "CAP_NET_RAW"
+)
+
+CAPABILITY_POLICY_BASE = {
+    "allowed_capabilities": ALLOWED_CAPABILITIES,
+    "blocked_capabilities": BLOCKED_CAPABILITIES,
+    "drop_all_capabilities": False,
+    "no_new_privileges": True,
+    "seccomp_profile": "default",
+    "apparmor_profile": "default"
+}
+
+RESOURCE_LIMITS_BASE = {
+    "network_bandwidth_limit": "100Mbps",
+    "process_limit": 1000,
+    "file_descriptor_limit": 1024,
+    "thread_limit": 500,
+    "enforce_limits": True
+}
+
+AUDIT_CONFIG_BASE = {
+    "enabled": True,
+    "log_level": "info",
+    "log_syscalls": True,
+    "log_network": True,
+    "log_filesystem": True,
+    "log_processes": True,
+    "retention_days": 30,
+    "real_time_alerts": True,
+    "alert_rules": (
+        {"event": "privilege_escalation", "severity": "high"},
+        {"event": "network_anomaly", "severity": "medium"},
+        {"event": "filesystem_violation", "severity": "medium"}
+    )
+}
+
+ENCRYPTION_CONFIG_BASE = {
+    "disk_encryption": True,
+    "network_encryption": True,
+    "memory_encryption": False,  # Requires special hardware
+    "encryption_algorithm": "AES-256",
+    "key_management": "internal",
+    "secure_boot": True
+}
+
+class SecurityLevel(str, Enum):
     """Security levels for environments"""
     LOW = "low"
     MEDIUM = "medium"
     HIGH = "high"
     MAXIMUM = "maximum"
 
-class IsolationMode(Enum):
+class IsolationMode(str, Enum):
     """Isolation modes"""
     NONE = "none"
     PROCESS = "process"
@@ -31,110 +223,255 @@ class IsolationMode(Enum):
     VM = "vm"
     HARDWARE = "hardware"
 
+# Isolation by OS family token, checked in order against the lowercased base_os
+OS_FAMILY_ISOLATION = (
+    ("windows", IsolationMode.VM),
+    ("linux", IsolationMode.CONTAINER),
+    ("ubuntu", IsolationMode.CONTAINER)
+)
+
+@lru_cache(maxsize=64)
+def _classify_os(base_os: str) -> IsolationMode:
+    """Isolation mode for a base OS name; unknown families get a VM"""
+    base_os = base_os.lower()
+    for family, isolation_mode in OS_FAMILY_ISOLATION:
+        if family in base_os:
+            return isolation_mode
+    return IsolationMode.VM
+
+class SpecFingerprint(NamedTuple):
+    """The EnvironmentSpec fields security policies are derived from"""
+    base_os: str
+    apps: FrozenSet[str]
+    network_mode: NetworkMode
+    gpu_enabled: bool
+    cpu_cores: int
+    memory_mb: int
+    disk_gb: int
+
+def _fingerprint(spec: EnvironmentSpec) -> SpecFingerprint:
+    """Hashable key for the parts of a spec that shape its security config"""
+    return SpecFingerprint(
+        spec.base_os,
+        frozenset(spec.apps),
+        spec.network_mode,
+        spec.gpu_enabled,
+        spec.cpu_cores,
+        spec.memory_mb,
+        spec.disk_gb
+    )
+
 class SecuritySandbox:
     """Manages security policies and isolation for environments"""
     
+    __slots__ = (
+        "network_policies",
+        "filesystem_policies",
+        "_cached_security_config",
+        "_shape_configs",
+        "_rule_hits",
+        "_apply_inflight",
+        "_env_locks",
+        "_domain_tries"
+    )
+    
     def __init__(self):
-        self.security_policies: Dict[str, Dict] = {}
-        self.network_policies: Dict[str, Dict] = {}
+        # Network policy templates by mode name; config generation may run before initialize()
+        self.network_policies: Dict[str, Dict] = {mode.value: policy for mode, policy in NETWORK_MODE_POLICIES.items()}
         self.filesystem_policies: Dict[str, Dict] = {}
-        self.capability_policies: Dict[str, Dict] = {}
+        # Generated configs by spec fingerprint; identical specs get identical policies
+        self._cached_security_config = lru_cache(maxsize=SECURITY_CONFIG_CACHE_SIZE)(self._build_security_config)
+        # Resource-independent config parts by spec shape; there are at most a few dozen shapes
+        self._shape_configs: Dict[Tuple, Dict[str, Any]] = {}
+        # Firewall rule match counts reported by the enforcement layer
+        self._rule_hits: Counter = Counter()
+        # Policy applications in progress by (env_id, serialized config)
+        self._apply_inflight: Dict[Tuple[str, str], asyncio.Task] = {}
+        # Per-environment locks; distinct environments apply policies in parallel
+        self._env_locks: WeakValueDictionary[str, asyncio.Lock] = WeakValueDictionary()
+        # Blocked domain tries by network mode; kept out of configs so no environment can change them
+        self._domain_tries: Dict[str, Dict[str, Any]] = {
+            mode.value: _build_domain_trie(policy["blocked_domains"])
+            for mode, policy in NETWORK_MODE_POLICIES.items()
+            if policy["blocked_domains"]
+        }
     
     async def initialize(self):
         """Initialize the security sandbox"""
         logger.info("Initializing security sandbox")
         
         # Load default security policies
-        await self._load_default_policies()
+        self._load_default_policies()
         
         # Initialize security modules
-        await self._initialize_security_modules()
+        self._initialize_security_modules()
         
         logger.info("Security sandbox initialized")
     
     async def create_security_config(self, spec: EnvironmentSpec) -> Dict[str, Any]:
         """Create security configuration for an environment"""
-        logger.info(f"Creating security config for environment with OS: {spec.base_os}")
+        logger.info("Creating security config for environment with OS: %s", spec.base_os)
+        
+        # Cached configs share rule dicts with each other and the module templates,
+        # so every caller gets a deep copy it can change without affecting others
+        security_config = copy.deepcopy(self._cached_security_config(_fingerprint(spec)))
+        
+        network_policy = security_config["network_policy"]
+        if network_policy["firewall_rules"]:
+            network_policy["firewall_rules"] = self._order_firewall_rules(network_policy["firewall_rules"])
+        
+        logger.info("Security config created with level: %s", security_config["security_level"])
+        return security_config
+    
+    def is_domain_blocked(self, network_policy: Mapping[str, Any], domain: str) -> bool:
+        """Check a DNS query against the blocked domains of a network policy's mode"""
+        trie = self._domain_tries.get(network_policy["mode"])
+        return trie is not None and _trie_has_domain(domain, trie)
+    
+    def record_hit(self, env_id: str, rule_key: str):
+        """Count a firewall rule match reported by an environment's enforcement layer"""
+        self._rule_hits[rule_key] += 1
+    
+    def _order_firewall_rules(self, rules: Tuple[Dict[str, Any], ...]) -> Tuple[Dict[str, Any], ...]:
+        """Move frequently hit rules forward within each run of same-action rules"""
+        # Rules are first-match, so only adjacent rules with the same action can be
+        # swapped without changing which packets are allowed
+        ordered: List[Dict[str, Any]] = []
+        run: List[Dict[str, Any]] = []
+        for rule in rules:
+            if run and run[-1]["action"] != rule["action"]:
+                ordered.extend(sorted(run, key=lambda r: -self._rule_hits[_rule_key(r)]))
+                run = []
+            run.append(rule)
+        ordered.extend(sorted(run, key=lambda r: -self._rule_hits[_rule_key(r)]))
+        return tuple(ordered)
+    
+    def clear_cache(self):
+        """Drop cached security configs, e.g. after policy templates change"""
+        self._cached_security_config.cache_clear()
+        self._shape_configs.clear()
+    
+    def _build_security_config(self, spec: SpecFingerprint) -> Dict[str, Any]:
+        """Build the security configuration for a spec fingerprint"""
+        isolation_mode = self._determine_isolation_mode(spec)
+        
+        # Everything but resource limits depends only on the spec's shape
+        shape = (
+            spec.network_mode,
+            isolation_mode,
+            not HIGH_SECURITY_APPS.isdisjoint(spec.apps),
+            "tor_browser" in spec.apps,
+            "docker" in spec.apps,
+            "development" in spec.apps
+        )
+        shape_config = self._shape_configs.get(shape)
+        if shape_config is None:
+            shape_config = self._build_shape_config(spec, isolation_mode)
+            self._shape_configs[shape] = shape_config
         
+        return {**shape_config, "resource_limits": self._create_resource_limits(spec)}
+    
+    def _build_shape_config(self, spec: SpecFingerprint, isolation_mode: IsolationMode) -> Dict[str, Any]:
+        """Build and validate the resource-independent part of a security configuration"""
         # Determine security level based on specification
         security_level = self._determine_security_level(spec)
         
         # Create comprehensive security configuration
         security_config = {
             "security_level": security_level.value,
-            "isolation_mode": self._determine_isolation_mode(spec).value,
-            "network_policy": await self._create_network_policy(spec),
-            "filesystem_policy": await self._create_filesystem_policy(spec),
-            "capability_policy": await self._create_capability_policy(spec),
-            "resource_limits": await self._create_resource_limits(spec),
-            "audit_config": await self._create_audit_config(spec),
-            "encryption_config": await self._create_encryption_config(spec)
+            "isolation_mode": isolation_mode.value,
+            "network_policy": self._create_network_policy(spec),
+            "filesystem_policy": self._create_filesystem_policy(spec),
+            "capability_policy": self._create_capability_policy(spec),
+            "audit_config": self._create_audit_config(spec),
+            "encryption_config": self._create_encryption_config(spec)
         }
         
         # Validate security configuration
-        await self._validate_security_config(security_config)
+        self._validate_security_config(security_config)
         
-        logger.info(f"Security config created with level: {security_level.value}")
         return security_config
     
     async def apply_security_policies(self, env_id: str, security_config: Dict) -> bool:
         """Apply security policies to an environment"""
-        logger.info(f"Applying security policies to environment {env_id}")
+        # Concurrent calls applying the same config to the same environment share one run
+        key = (env_id, json.dumps(security_config, sort_keys=True))
+        task = self._apply_inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._apply_security_policies(env_id, security_config))
+            self._apply_inflight[key] = task
+            task.add_done_callback(lambda _: self._apply_inflight.pop(key, None))
+        else:
+            logger.info("Security policies already being applied to environment %s, waiting", env_id)
         
-        try:
-            # Apply network policies
-            await self._apply_network_policies(env_id, security_config["network_policy"])
-            
-            # Apply filesystem policies
-            await self._apply_filesystem_policies(env_id, security_config["filesystem_policy"])
-            
-            # Apply capability restrictions
-            await self._apply_capability_policies(env_id, security_config["capability_policy"])
-            
-            # Set up resource limits
-            await self._apply_resource_limits(env_id, security_config["resource_limits"])
-            
-            # Configure audit logging
-            await self._apply_audit_config(env_id, security_config["audit_config"])
-            
-            logger.info(f"Security policies applied to environment {env_id}")
-            return True
+        return await asyncio.shield(task)
+    
+    async def _apply_security_policies(self, env_id: str, security_config: Dict) -> bool:
+        """Run each policy applier for an environment"""
+        # Applications to the same environment serialize; different environments run in parallel
+        async with self._lock(env_id):
+            logger.info("Applying security policies to environment %s", env_id)
             
-        except Exception as e:
-            logger.error(f"Failed to apply security policies to environment {env_id}: {str(e)}")
-            raise
+            try:
+                # The appliers touch independent subsystems, so run them concurrently
+                await asyncio.gather(
+                    self._apply_network_policies(env_id, security_config["network_policy"]),
+                    self._apply_filesystem_policies(env_id, security_config["filesystem_policy"]),
+                    self._apply_capability_policies(env_id, security_config["capability_policy"]),
+                    self._apply_resource_limits(env_id, security_config["resource_limits"]),
+                    self._apply_audit_config(env_id, security_config["audit_config"])
+                )
+                
+                logger.info("Security policies applied to environment %s", env_id)
+                return True
+                
+            except Exception as e:
+                logger.error("Failed to apply security policies to environment %s: %s", env_id, e)
+                raise
+    
+    def _lock(self, env_id: str) -> asyncio.Lock:
+        """Get the lock serializing policy changes to a single environment"""
+        lock = self._env_locks.get(env_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._env_locks[env_id] = lock
+        return lock
     
     async def validate_environment_security(self, env_id: str) -> Dict[str, Any]:
         """Validate security status of an environment"""
-        logger.info(f"Validating security for environment {env_id}")
+        logger.info("Validating security for environment %s", env_id)
         
+        check_results = await asyncio.gather(
+            self._check_network_isolation(env_id),
+            self._check_filesystem_isolation(env_id),
+            self._check_capability_restrictions(env_id),
+            self._check_resource_limits(env_id),
+            self._check_audit_logging(env_id)
+        )
+        passed = [result["passed"] for result in check_results]
+        
+        # Results are stored as parallel arrays aligned with SECURITY_CHECK_NAMES
         validation_results = {
             "env_id": env_id,
             "overall_status": "secure",
-            "checks": {
-                "network_isolation": await self._check_network_isolation(env_id),
-                "filesystem_isolation": await self._check_filesystem_isolation(env_id),
-                "capability_restrictions": await self._check_capability_restrictions(env_id),
-                "resource_limits": await self._check_resource_limits(env_id),
-                "audit_logging": await self._check_audit_logging(env_id)
-            },
+            "check_names": SECURITY_CHECK_NAMES,
+            "checks_passed": passed,
+            "checks_details": [result["details"] for result in check_results],
             "vulnerabilities": [],
             "recommendations": []
         }
         
         # Determine overall status
-        failed_checks = [check for check, result in validation_results["checks"].items() if not result["passed"]]
-        if failed_checks:
+        if not all(passed):
             validation_results["overall_status"] = "vulnerable"
-            validation_results["vulnerabilities"] = failed_checks
+            validation_results["vulnerabilities"] = list(compress(SECURITY_CHECK_NAMES, map(not_, passed)))
         
         return validation_results
     
-    def _determine_security_level(self, spec: EnvironmentSpec) -> SecurityLevel:
+    def _determine_security_level(self, spec: SpecFingerprint) -> SecurityLevel:
         """Determine appropriate security level for environment"""
         # High security for certain applications
-        high_security_apps = ["tor_browser", "vpn", "crypto"]
-        if any(app in spec.apps for app in high_security_apps):
+        if not HIGH_SECURITY_APPS.isdisjoint(spec.apps):
             return SecurityLevel.HIGH
         
         # Medium security for network access
@@ -147,173 +484,66 @@ class SecuritySandbox:
         
         return SecurityLevel.MEDIUM
     
-    def _determine_isolation_mode(self, spec: EnvironmentSpec) -> IsolationMode:
+    def _determine_isolation_mode(self, spec: SpecFingerprint) -> IsolationMode:
         """Determine appropriate isolation mode"""
-        # Hardware isolation for high-security environments
-        if "windows" in spec.base_os.lower() or spec.gpu_enabled:
+        # Hardware isolation for GPU environments
+        if spec.gpu_enabled:
             return IsolationMode.VM
         
-        # Container isolation for Linux environments
-        if "linux" in spec.base_os.lower() or "ubuntu" in spec.base_os.lower():
-            return IsolationMode.CONTAINER
-        
-        return IsolationMode.VM
+        return _classify_os(spec.base_os)
     
-    async def _create_network_policy(self, spec: EnvironmentSpec) -> Dict[str, Any]:
+    def _create_network_policy(self, spec: SpecFingerprint) -> Dict[str, Any]:
         """Create network security policy"""
-        policy = {
-            "mode": spec.network_mode.value,
-            "allowed_protocols": [],
-            "blocked_domains": [],
-            "firewall_rules": [],
-            "dns_filtering": False,
-            "vpn_required": False
-        }
-        
-        if spec.network_mode == NetworkMode.ISOLATED:
-            policy.update({
-                "allowed_protocols": [],
-                "internet_access": False,
-                "local_network_access": False
-            })
-        elif spec.network_mode == NetworkMode.LIMITED:
-            policy.update({
-                "allowed_protocols": ["https", "dns"],
-                "blocked_domains": ["facebook.com", "twitter.com", "social-media.com"],
-                "dns_filtering": True,
-                "firewall_rules": [
-                    {"action": "allow", "protocol": "tcp", "port": 443},
-                    {"action": "allow", "protocol": "udp", "port": 53},
-                    {"action": "deny", "protocol": "*", "port": "*"}
-                ]
-            })
-        else:  # FULL access
-            policy.update({
-                "allowed_protocols": ["*"],
-                "internet_access": True,
-                "local_network_access": True
-            })
+        # NetworkMode is a str enum, so it looks up the mode-name keys directly
+        policy = self.network_policies[spec.network_mode].copy()
         
         # Special handling for Tor browser
         if "tor_browser" in spec.apps:
-            policy.update({
-                "tor_required": True,
-                "direct_connections_blocked": True,
-                "dns_over_tor": True
-            })
+            policy.update(TOR_NETWORK_POLICY)
+        
+        if policy["firewall_rules"]:
+            policy["firewall_rules"] = _dedupe_firewall_rules(policy["firewall_rules"])
         
         return policy
     
-    async def _create_filesystem_policy(self, spec: EnvironmentSpec) -> Dict[str, Any]:
+    def _create_filesystem_policy(self, spec: SpecFingerprint) -> Dict[str, Any]:
         """Create filesystem security policy"""
-        policy = {
-            "read_only_system": True,
-            "isolated_home": True,
-            "temp_filesystem": True,
-            "encrypted_storage": True,
-            "mount_restrictions": [],
-            "file_permissions": "strict",
-            "allowed_paths": [
-                "/home/user",
-                "/tmp",
-                "/var/tmp"
-            ],
-            "blocked_paths": [
-                "/etc/passwd",
-                "/etc/shadow",
-                "/root",
-                "/boot"
-            ]
-        }
+        policy = FILESYSTEM_POLICY_BASE.copy()
         
         # Adjust based on applications
-        if "development" in str(spec.apps):
-            policy["allowed_paths"].extend([
-                "/usr/local",
-                "/opt"
-            ])
+        if "development" in spec.apps:
+            policy["allowed_paths"] = DEVELOPMENT_ALLOWED_PATHS
         
         return policy
     
-    async def _create_capability_policy(self, spec: EnvironmentSpec) -> Dict[str, Any]:
+    def _create_capability_policy(self, spec: SpecFingerprint) -> Dict[str, Any]:
         """Create capability restriction policy"""
-        # Default minimal capabilities
-        allowed_capabilities = [
-            "CAP_CHOWN",
-            "CAP_DAC_OVERRIDE",
-            "CAP_FOWNER",
-            "CAP_SETGID",
-            "CAP_SETUID"
-        ]
-        
-        blocked_capabilities = [
-            "CAP_SYS_ADMIN",
-            "CAP_SYS_MODULE",
-            "CAP_SYS_RAWIO",
-            "CAP_SYS_BOOT",
-            "CAP_SYS_TIME",
-            "CAP_NET_ADMIN",
-            "CAP_NET_RAW"
-        ]
-        
-        policy = {
-            "allowed_capabilities": allowed_capabilities,
-            "blocked_capabilities": blocked_capabilities,
-            "drop_all_capabilities": False,
-            "no_new_privileges": True,
-            "seccomp_profile": "default",
-            "apparmor_profile": "default"
-        }
+        policy = CAPABILITY_POLICY_BASE.copy()
         
         # Adjust for specific applications
         if "docker" in spec.apps:
-            policy["allowed_capabilities"].append("CAP_SYS_ADMIN")
+            policy["allowed_capabilities"] = ALLOWED_CAPABILITIES + ("CAP_SYS_ADMIN",)
         
         return policy
     
-    async def _create_resource_limits(self, spec: EnvironmentSpec) -> Dict[str, Any]:
+    def _create_resource_limits(self, spec: SpecFingerprint) -> Dict[str, Any]:
         """Create resource limitation policy"""
         return {
             "cpu_limit": spec.cpu_cores,
             "memory_limit": spec.memory_mb,
             "disk_limit": spec.disk_gb,
-            "network_bandwidth_limit": "100Mbps",
-            "process_limit": 1000,
-            "file_descriptor_limit": 1024,
-            "thread_limit": 500,
-            "enforce_limits": True
+            **RESOURCE_LIMITS_BASE
         }
     
-    async def _create_audit_config(self, spec: EnvironmentSpec) -> Dict[str, Any]:
+    def _create_audit_config(self, spec: SpecFingerprint) -> Dict[str, Any]:
         """Create audit logging configuration"""
-        return {
-            "enabled": True,
-            "log_level": "info",
-            "log_syscalls": True,
-            "log_network": True,
-            "log_filesystem": True,
-            "log_processes": True,
-            "retention_days": 30,
-            "real_time_alerts": True,
-            "alert_rules": [
-                {"event": "privilege_escalation", "severity": "high"},
-                {"event": "network_anomaly", "severity": "medium"},
-                {"event": "filesystem_violation", "severity": "medium"}
-            ]
-        }
+        return AUDIT_CONFIG_BASE.copy()
     
-    async def _create_encryption_config(self, spec: EnvironmentSpec) -> Dict[str, Any]:
+    def _create_encryption_config(self, spec: SpecFingerprint) -> Dict[str, Any]:
         """Create encryption configuration"""
-        return {
-            "disk_encryption": True,
-            "network_encryption": True,
-            "memory_encryption": False,  # Requires special hardware
-            "encryption_algorithm": "AES-256",
-            "key_management": "internal",
-            "secure_boot": True
-        }
+        return ENCRYPTION_CONFIG_BASE.copy()
     
-    async def _validate_security_config(self, config: Dict) -> bool:
+    def _validate_security_config(self, config: Dict) -> bool:
         """Validate security configuration"""
         required_fields = [
             "security_level",
@@ -329,30 +559,10 @@ class SecuritySandbox:
         
         return True
     
-    async def _load_default_policies(self):
+    def _load_default_policies(self):
         """Load default security policies"""
         logger.info("Loading default security policies")
         
-        # Default network policies
-        self.network_policies = {
-            "isolated": {
-                "internet_access": False,
-                "local_network_access": False,
-                "allowed_protocols": []
-            },
-            "limited": {
-                "internet_access": True,
-                "local_network_access": False,
-                "allowed_protocols": ["https", "dns"],
-                "content_filtering": True
-            },
-            "full": {
-                "internet_access": True,
-                "local_network_access": True,
-                "allowed_protocols": ["*"]
-            }
-        }
-        
         # Default filesystem policies
         self.filesystem_policies = {
             "strict": {
@@ -367,7 +577,7 @@ class SecuritySandbox:
             }
         }
     
-    async def _initialize_security_modules(self):
+    def _initialize_security_modules(self):
         """Initialize security enforcement modules"""
         logger.info("Initializing security enforcement modules")
         
@@ -383,52 +593,52 @@ class SecuritySandbox:
     # Security enforcement methods
     async def _apply_network_policies(self, env_id: str, policy: Dict):
         """Apply network security policies"""
-        logger.info(f"Applying network policies to {env_id}")
+        logger.info("Applying network policies to %s", env_id)
         # Implementation would configure iptables, network namespaces, etc.
         pass
     
     async def _apply_filesystem_policies(self, env_id: str, policy: Dict):
         """Apply filesystem security policies"""
-        logger.info(f"Applying filesystem policies to {env_id}")
+        logger.info("Applying filesystem policies to %s", env_id)
         # Implementation would configure bind mounts, chroot, etc.
         pass
     
     async def _apply_capability_policies(self, env_id: str, policy: Dict):
         """Apply capability restriction policies"""
-        logger.info(f"Applying capability policies to {env_id}")
+        logger.info("Applying capability policies to %s", env_id)
         # Implementation would configure capabilities, seccomp, etc.
         pass
     
     async def _apply_resource_limits(self, env_id: str, limits: Dict):
         """Apply resource limitation policies"""
-        logger.info(f"Applying resource limits to {env_id}")
+        logger.info("Applying resource limits to %s", env_id)
         # Implementation would configure cgroups
         pass
     
     async def _apply_audit_config(self, env_id: str, config: Dict):
         """Apply audit logging configuration"""
-        logger.info(f"Applying audit config to {env_id}")
+        logger.info("Applying audit config to %s", env_id)
         # Implementation would configure auditd, logging, etc.
         pass
     
     # Security validation methods
-    async def _check_network_isolation(self, env_id: str) -> Dict[str, Any]:
+    async def _check_network_isolation(self, env_id: str) -> Mapping[str, Any]:
         """Check network isolation status"""
-        return {"passed": True, "details": "Network isolation verified"}
+        return CHECK_OK["network_isolation"]
     
-    async def _check_filesystem_isolation(self, env_id: str) -> Dict[str, Any]:
+    async def _check_filesystem_isolation(self, env_id: str) -> Mapping[str, Any]:
         """Check filesystem isolation status"""
-        return {"passed": True, "details": "Filesystem isolation verified"}
+        return CHECK_OK["filesystem_isolation"]
     
-    async def _check_capability_restrictions(self, env_id: str) -> Dict[str, Any]:
+    async def _check_capability_restrictions(self, env_id: str) -> Mapping[str, Any]:
         """Check capability restrictions"""
-        return {"passed": True, "details": "Capability restrictions verified"}
+        return CHECK_OK["capability_restrictions"]
     
-    async def _check_resource_limits(self, env_id: str) -> Dict[str, Any]:
+    async def _check_resource_limits(self, env_id: str) -> Mapping[str, Any]:
         """Check resource limits"""
-        return {"passed": True, "details": "Resource limits verified"}
+        return CHECK_OK["resource_limits"]
     
-    async def _check_audit_logging(self, env_id: str) -> Dict[str, Any]:
+    async def _check_audit_logging(self, env_id: str) -> Mapping[str, Any]:
         """Check audit logging status"""
-        return {"passed": True, "details": "Audit logging verified"}
+        return CHECK_OK["audit_logging"]
 
@@ -4,17 +4,21 @@ Manages real-time GUI streaming using SPICE and RDP protocols
 """
 
 import asyncio
-import json
-import uuid
+import heapq
+import secrets
+from collections import defaultdict
 import websockets
 import subprocess
-from typing import Dict, List, Optional, Any, Set
+from typing import DefaultDict, Dict, List, Optional, Any, Set, Tuple
 from pathlib import Path
 from enum import Enum
 import logging
 import socket
 import struct
+import time
 import ssl
+import re
+import orjson
 
 from ..api.models.schemas import ClientType
 from ..api.core.config import settings
@@ -22,6 +26,36 @@ from ..api.core.logging import get_logger
 
 logger = get_logger(__name__)
 
+# Websocket paths name a connection as /conn-<8 hex digits>
+CONNECTION_PATH_RE = re.compile(r"/(conn-[0-9a-f]{8})/?")
+
+# Seconds without client activity before a connection is disconnected
+INACTIVE_TIMEOUT = 600
+
+# Outbound messages buffered per client before new ones are dropped
+OUT_QUEUE_SIZE = 64
+
+# Most queued messages merged into one websocket frame
+MAX_MERGED_MESSAGES = 16
+
+# Kernel send buffer for client sockets; small so frames aren't queued behind stale ones
+CLIENT_SNDBUF_BYTES = 8192
+
+# Frame rate used once the screen has stayed unchanged for IDLE_FRAME_THRESHOLD ticks
+IDLE_FRAME_RATE = 15
+IDLE_FRAME_THRESHOLD = 30
+
+# Unsent bytes in a websocket transport above which no new frame is produced
+WRITE_BUFFER_HIGH_WATER = 256 * 1024
+
+# Binary frame header (version, compression, width, height, frame_id, timestamp_ns),
+# followed by the raw frame bytes; control messages stay JSON text frames
+FRAME_HEADER = struct.Struct("<BBHHIQ")
+FRAME_VERSION = 1
+
+# Pre-encoded reply to client pings
+PONG_MESSAGE = orjson.dumps({"type": "pong"})
+
 class StreamingProtocol(Enum):
     """Supported streaming protocols"""
     SPICE = "spice"
@@ -44,9 +78,64 @@ class ConnectionState(Enum):
     DISCONNECTED = "disconnected"
     ERROR = "error"
 
+# (resolution, frame_rate, compression_level) for each explicit quality
+QUALITY_PRESETS = {
+    StreamQuality.LOW: ((1024, 768), 15, 9),
+    StreamQuality.MEDIUM: ((1280, 720), 24, 6),
+    StreamQuality.HIGH: ((1920, 1080), 30, 3)
+}
+
+# Mobile clients on AUTO quality get a lower resolution and frame rate, higher compression
+MOBILE_AUTO_PRESET = ((1280, 720), 24, 8)
+
+# Settings by (client type, quality); missing combinations keep the current settings
+CONNECTION_PRESETS = {
+    **{(client_type, quality): preset
+       for client_type in ClientType for quality, preset in QUALITY_PRESETS.items()},
+    (ClientType.ANDROID, StreamQuality.AUTO): MOBILE_AUTO_PRESET,
+    (ClientType.IOS, StreamQuality.AUTO): MOBILE_AUTO_PRESET
+}
+
+def _is_pointer_move(event: Dict[str, Any]) -> bool:
+    """Whether an input event only moves the pointer"""
+    return event.get("input_type") == "mouse" and event.get("action") == "move"
+
 class StreamingConnection:
     """Represents a streaming connection to an environment"""
     
+    __slots__ = (
+        "connection_id",
+        "env_id",
+        "user_id",
+        "client_type",
+        "protocol",
+        "quality",
+        "state",
+        "websocket",
+        "spice_process",
+        "rdp_process",
+        "created_at",
+        "last_activity",
+        "bandwidth_usage",
+        "bytes_sent",
+        "sampled_bytes",
+        "sampled_at",
+        "frame_rate",
+        "resolution",
+        "compression_level",
+        "metadata",
+        "out_queue",
+        "pending_frame",
+        "frames_dropped",
+        "last_frame_hash",
+        "unchanged_frames",
+        "wakeup",
+        "writer_task",
+        "pending_input",
+        "input_flush",
+        "input_flush_task"
+    )
+    
     def __init__(self, connection_id: str, env_id: str, user_id: int, client_type: ClientType):
         self.connection_id = connection_id
         self.env_id = env_id
@@ -58,26 +147,48 @@ class StreamingConnection:
         self.websocket = None
         self.spice_process = None
         self.rdp_process = None
-        self.created_at = asyncio.get_event_loop().time()
-        self.last_activity = asyncio.get_event_loop().time()
+        self.created_at = self.last_activity = time.monotonic()
+        # Bytes per second over the last monitor interval, sampled from bytes_sent
         self.bandwidth_usage = 0
+        self.bytes_sent = 0
+        self.sampled_bytes = 0
+        self.sampled_at = self.created_at
         self.frame_rate = 30
         self.resolution = (1920, 1080)
         self.compression_level = 6
         self.metadata = {}
+        # Encoded messages waiting for the connection's writer task
+        self.out_queue: asyncio.Queue = asyncio.Queue(maxsize=OUT_QUEUE_SIZE)
+        # Latest unsent frame; a newer frame replaces it rather than queueing behind it
+        self.pending_frame: Optional[bytes] = None
+        self.frames_dropped = 0
+        # Hash of the last frame sent and how many identical frames followed it
+        self.last_frame_hash: Optional[int] = None
+        self.unchanged_frames = 0
+        # Set whenever the writer has a queued message or pending frame to send
+        self.wakeup = asyncio.Event()
+        self.writer_task: Optional[asyncio.Task] = None
+        # Input waiting for the next per-frame flush
+        self.pending_input: List[Dict[str, Any]] = []
+        self.input_flush: Optional[asyncio.TimerHandle] = None
+        self.input_flush_task: Optional[asyncio.Task] = None
 
 class StreamingGateway:
     """Main streaming gateway for managing GUI streams"""
     
     def __init__(self):
         self.connections: Dict[str, StreamingConnection] = {}
-        self.environment_connections: Dict[str, Set[str]] = {}  # env_id -> connection_ids
+        self.environment_connections: DefaultDict[str, Set[str]] = defaultdict(set)  # env_id -> connection_ids
         self.websocket_server = None
         self.spice_servers: Dict[str, subprocess.Popen] = {}
         self.rdp_servers: Dict[str, subprocess.Popen] = {}
         self.running = False
-        self.port_pool = list(range(5900, 6000))  # VNC/SPICE port range
+        self._free_ports: set[int] = set(range(5900, 6000))  # VNC/SPICE port range
         self.allocated_ports: Dict[str, int] = {}
+        # (earliest possible expiry, connection_id); an entry is re-pushed when the
+        # connection saw activity since it was queued
+        self._expiry_heap: List[Tuple[float, str]] = []
+        self._expiry_added = asyncio.Event()
     
     async def start(self):
         """Start the streaming gateway"""
@@ -120,7 +231,11 @@ class StreamingGateway:
                               protocol: StreamingProtocol = StreamingProtocol.SPICE,
                               quality: StreamQuality = StreamQuality.AUTO) -> str:
         """Create a new streaming connection"""
-        connection_id = f"conn-{uuid.uuid4().hex[:8]}"
+        # The websocket path carries no other credential, so ids stay unguessable;
+        # retrying on a live id rules out collisions
+        connection_id = f"conn-{secrets.token_hex(4)}"
+        while connection_id in self.connections:
+            connection_id = f"conn-{secrets.token_hex(4)}"
         
         logger.info(f"Creating streaming connection {connection_id} for environment {env_id}")
         
@@ -133,10 +248,10 @@ class StreamingGateway:
         
         # Store connection
         self.connections[connection_id] = connection
+        heapq.heappush(self._expiry_heap, (connection.last_activity + INACTIVE_TIMEOUT, connection_id))
+        self._expiry_added.set()
         
         # Track environment connections
-        if env_id not in self.environment_connections:
-            self.environment_connections[env_id] = set()
         self.environment_connections[env_id].add(connection_id)
         
         # Start streaming server for the environment if not already running
@@ -157,6 +272,9 @@ class StreamingGateway:
         
         logger.info(f"WebSocket connected to {connection_id}")
         
+        # A single writer owns websocket.send for this connection
+        connection.writer_task = asyncio.create_task(self._writer_loop(connection))
+        
         # Start streaming
         await self._start_streaming(connection)
         
@@ -171,6 +289,14 @@ class StreamingGateway:
         
         logger.info(f"Disconnecting client {connection_id}")
         
+        # Stop the writer before closing the socket under it
+        if connection.writer_task:
+            connection.writer_task.cancel()
+        if connection.input_flush:
+            connection.input_flush.cancel()
+        if connection.input_flush_task:
+            connection.input_flush_task.cancel()
+        
         # Close WebSocket
         if connection.websocket:
             try:
@@ -182,13 +308,14 @@ class StreamingGateway:
         connection.state = ConnectionState.DISCONNECTED
         
         # Remove from environment tracking
-        if connection.env_id in self.environment_connections:
-            self.environment_connections[connection.env_id].discard(connection_id)
+        env_connections = self.environment_connections.get(connection.env_id)
+        if env_connections is not None:
+            env_connections.discard(connection_id)
             
             # Stop streaming server if no more connections
-            if not self.environment_connections[connection.env_id]:
-                await self._stop_streaming_server(connection.env_id)
+            if not env_connections:
                 del self.environment_connections[connection.env_id]
+                await self._stop_streaming_server(connection.env_id)
         
         # Remove connection
         del self.connections[connection_id]
@@ -202,18 +329,53 @@ class StreamingGateway:
             return False
         
         connection = self.connections[connection_id]
-        connection.last_activity = asyncio.get_event_loop().time()
+        connection.last_activity = time.monotonic()
         
-        # Forward input to appropriate streaming server
-        if connection.protocol == StreamingProtocol.SPICE:
-            await self._handle_spice_input(connection, event)
-        elif connection.protocol == StreamingProtocol.RDP:
-            await self._handle_rdp_input(connection, event)
-        elif connection.protocol == StreamingProtocol.VNC:
-            await self._handle_vnc_input(connection, event)
+        # Buffer input for the next frame; a pointer move directly following
+        # another replaces it, everything else keeps its order
+        pending = connection.pending_input
+        if pending and _is_pointer_move(event) and _is_pointer_move(pending[-1]):
+            pending[-1] = event
+        else:
+            pending.append(event)
+        
+        if connection.input_flush is None:
+            self._schedule_input_flush(connection)
         
         return True
     
+    def _schedule_input_flush(self, connection: StreamingConnection):
+        """Flush buffered input one frame interval from now"""
+        connection.input_flush = asyncio.get_running_loop().call_later(
+            1.0 / connection.frame_rate, self._start_input_flush, connection
+        )
+    
+    def _start_input_flush(self, connection: StreamingConnection):
+        """Run the flush as a task the connection keeps a reference to"""
+        connection.input_flush_task = asyncio.create_task(self._flush_input(connection))
+    
+    async def _flush_input(self, connection: StreamingConnection):
+        """Forward a frame's worth of buffered input to the streaming server"""
+        events, connection.pending_input = connection.pending_input, []
+        
+        # Forward input to appropriate streaming server
+        try:
+            for event in events:
+                if connection.protocol == StreamingProtocol.SPICE:
+                    await self._handle_spice_input(connection, event)
+                elif connection.protocol == StreamingProtocol.RDP:
+                    await self._handle_rdp_input(connection, event)
+                elif connection.protocol == StreamingProtocol.VNC:
+                    await self._handle_vnc_input(connection, event)
+        except Exception as e:
+            logger.error(f"Failed to forward input for connection {connection.connection_id}: {str(e)}")
+        
+        # Input that arrived during the flush waits for the next frame
+        connection.input_flush_task = None
+        connection.input_flush = None
+        if connection.pending_input:
+            self._schedule_input_flush(connection)
+    
     async def get_connection_info(self, connection_id: str) -> Optional[Dict[str, Any]]:
         """Get connection information"""
         if connection_id not in self.connections:
@@ -232,6 +394,7 @@ class StreamingGateway:
             "resolution": connection.resolution,
             "frame_rate": connection.frame_rate,
             "bandwidth_usage": connection.bandwidth_usage,
+            "bytes_sent": connection.bytes_sent,
             "created_at": connection.created_at,
             "last_activity": connection.last_activity
         }
@@ -252,23 +415,46 @@ class StreamingGateway:
         logger.info(f"Updated quality for {connection_id} from {old_quality.value} to {quality.value}")
         return True
     
+    def broadcast(self, env_id: str, message: Dict[str, Any]) -> int:
+        """Send one message to every client of an environment, returning how many got it"""
+        connection_ids = self.environment_connections.get(env_id)
+        if not connection_ids:
+            return 0
+        
+        # Encode once and hand every client the same bytes object
+        payload = orjson.dumps(message)
+        sent = 0
+        for connection_id in connection_ids:
+            connection = self.connections.get(connection_id)
+            if connection and connection.websocket:
+                self._enqueue(connection, payload)
+                sent += 1
+        return sent
+    
     async def _start_websocket_server(self):
         """Start WebSocket server for client connections"""
         async def handle_websocket(websocket, path):
+            connection_id: Optional[str] = None
             try:
-                # Extract connection ID from path
-                connection_id = path.strip('/')
+                # Extract connection ID from path, rejecting malformed paths up front
+                match = CONNECTION_PATH_RE.fullmatch(path)
+                if match is None:
+                    await websocket.close(code=4004, reason="Invalid connection ID")
+                    return
                 
-                if not await self.connect_websocket(connection_id, websocket):
+                if not await self.connect_websocket(match.group(1), websocket):
                     await websocket.close(code=4004, reason="Invalid connection ID")
                     return
+                connection_id = match.group(1)
+                
+                self._tune_client_socket(websocket)
                 
                 # Handle messages
                 async for message in websocket:
                     try:
-                        data = json.loads(message)
+                        data = orjson.loads(message)
                         await self._handle_websocket_message(connection_id, data)
-                    except json.JSONDecodeError:
+                    except orjson.JSONDecodeError:
                         logger.warning(f"Invalid JSON from {connection_id}: {message}")
                     except Exception as e:
                         logger.error(f"Error handling message from {connection_id}: {str(e)}")
@@ -278,19 +464,32 @@ class StreamingGateway:
             except Exception as e:
                 logger.error(f"WebSocket error: {str(e)}")
             finally:
-                if 'connection_id' in locals():
+                if connection_id is not None:
                     await self.disconnect_client(connection_id)
         
         # Start WebSocket server
         self.websocket_server = await websockets.serve(
             handle_websocket,
-            "0.0.0.0",
-            8765,  # WebSocket port
+            settings.streaming_host,
+            settings.streaming_websocket_port,
             ping_interval=20,
-            ping_timeout=10
+            ping_timeout=10,
+            compression=None,  # Frame data is already compressed
+            reuse_port=settings.streaming_reuse_port
         )
         
-        logger.info("WebSocket server started on port 8765")
+        logger.info(f"WebSocket server started on port {settings.streaming_websocket_port}")
+    
+    def _tune_client_socket(self, websocket):
+        """Disable Nagle and shrink the send buffer for low-latency frame delivery"""
+        sock = websocket.transport.get_extra_info("socket")
+        if sock is None:
+            return
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, CLIENT_SNDBUF_BYTES)
+        except OSError as e:
+            logger.warning(f"Failed to tune client socket: {str(e)}")
     
     async def _handle_websocket_message(self, connection_id: str, data: Dict[str, Any]):
         """Handle WebSocket message from client"""
@@ -305,32 +504,16 @@ class StreamingGateway:
             # Send pong response
             connection = self.connections.get(connection_id)
             if connection and connection.websocket:
-                await connection.websocket.send(json.dumps({"type": "pong"}))
+                self._enqueue(connection, PONG_MESSAGE)
         elif message_type == "resolution_change":
             await self._handle_resolution_change(connection_id, data)
     
     async def _optimize_connection_settings(self, connection: StreamingConnection):
         """Optimize connection settings based on client type and quality"""
-        # Mobile optimizations
-        if connection.client_type in [ClientType.ANDROID, ClientType.IOS]:
-            connection.resolution = (1280, 720)  # Lower resolution for mobile
-            connection.frame_rate = 24  # Lower frame rate
-            connection.compression_level = 8  # Higher compression
-        
-        # Quality-based optimizations
-        if connection.quality == StreamQuality.LOW:
-            connection.resolution = (1024, 768)
-            connection.frame_rate = 15
-            connection.compression_level = 9
-        elif connection.quality == StreamQuality.MEDIUM:
-            connection.resolution = (1280, 720)
-            connection.frame_rate = 24
-            connection.compression_level = 6
-        elif connection.quality == StreamQuality.HIGH:
-            connection.resolution = (1920, 1080)
-            connection.frame_rate = 30
-            connection.compression_level = 3
-        # AUTO quality will be determined dynamically based on bandwidth
+        # AUTO quality on desktop clients is left to dynamic bandwidth adjustment
+        preset = CONNECTION_PRESETS.get((connection.client_type, connection.quality))
+        if preset is not None:
+            connection.resolution, connection.frame_rate, connection.compression_level = preset
     
     async def _ensure_streaming_server(self, env_id: str, protocol: StreamingProtocol):
         """Ensure streaming server is running for environment"""
@@ -437,23 +620,41 @@ class StreamingGateway:
             
             # Simulate SPICE streaming (in real implementation, connect to actual SPICE server)
             frame_count = 0
+            
             while connection.state == ConnectionState.STREAMING and connection.websocket:
-                # Simulate frame data
-                frame_data = {
-                    "type": "frame",
-                    "protocol": "spice",
-                    "frame_id": frame_count,
-                    "timestamp": asyncio.get_event_loop().time(),
-                    "resolution": connection.resolution,
-                    "data": f"spice_frame_data_{frame_count}",  # Base64 encoded frame data
-                    "compression": connection.compression_level
-                }
+                # Pause encoding while the client still hasn't drained earlier frames
+                transport = getattr(connection.websocket, "transport", None)
+                if transport is not None and transport.get_write_buffer_size() > WRITE_BUFFER_HIGH_WATER:
+                    await asyncio.sleep(1.0 / connection.frame_rate)
+                    continue
                 
-                try:
-                    await connection.websocket.send(json.dumps(frame_data))
-                    connection.bandwidth_usage += len(json.dumps(frame_data))
-                except websockets.exceptions.ConnectionClosed:
-                    break
+                # Simulate frame data (raw encoded frame bytes in a real implementation)
+                raw_frame = f"spice_frame_data_{frame_count}".encode()
+                
+                # Skip identical frames before any serialization, and throttle while idle
+                frame_hash = hash(raw_frame)
+                if frame_hash == connection.last_frame_hash:
+                    connection.unchanged_frames += 1
+                    frame_rate = connection.frame_rate
+                    if connection.unchanged_frames > IDLE_FRAME_THRESHOLD:
+                        frame_rate = min(frame_rate, IDLE_FRAME_RATE)
+                    await asyncio.sleep(1.0 / frame_rate)
+                    continue
+                connection.last_frame_hash = frame_hash
+                connection.unchanged_frames = 0
+                
+                width, height = connection.resolution
+                header = FRAME_HEADER.pack(
+                    FRAME_VERSION,
+                    connection.compression_level,
+                    width,
+                    height,
+                    frame_count & 0xFFFFFFFF,
+                    time.monotonic_ns()
+                )
+                
+                # No base64 or JSON: the writer sends header and payload as one binary frame
+                self._offer_frame(connection, header + raw_frame)
                 
                 frame_count += 1
                 await asyncio.sleep(1.0 / connection.frame_rate)
@@ -462,6 +663,52 @@ class StreamingGateway:
             logger.error(f"SPICE streaming error for {connection.connection_id}: {str(e)}")
             connection.state = ConnectionState.ERROR
     
+    def _enqueue(self, connection: StreamingConnection, payload: bytes):
+        """Queue an encoded message for the connection's writer"""
+        try:
+            connection.out_queue.put_nowait(payload)
+        except asyncio.QueueFull:
+            logger.debug("Outbound queue full for %s, dropping message", connection.connection_id)
+            return
+        connection.wakeup.set()
+    
+    def _offer_frame(self, connection: StreamingConnection, payload: bytes):
+        """Hand a frame to the writer, dropping any older frame it hasn't sent yet"""
+        if connection.pending_frame is not None:
+            connection.frames_dropped += 1
+        connection.pending_frame = payload
+        connection.wakeup.set()
+    
+    async def _writer_loop(self, connection: StreamingConnection):
+        """Send queued messages as text, merging a backlog into one JSON array, then the latest binary frame"""
+        queue = connection.out_queue
+        try:
+            while True:
+                await connection.wakeup.wait()
+                connection.wakeup.clear()
+                
+                batch = []
+                while len(batch) < MAX_MERGED_MESSAGES and not queue.empty():
+                    batch.append(queue.get_nowait())
+                if not queue.empty():
+                    connection.wakeup.set()  # More backlog than one merge takes
+                frame = connection.pending_frame
+                connection.pending_frame = None
+                
+                if batch:
+                    payload = batch[0] if len(batch) == 1 else b"[" + b",".join(batch) + b"]"
+                    await connection.websocket.send(payload.decode())
+                    connection.bytes_sent += len(payload)
+                if frame is not None:
+                    await connection.websocket.send(frame)
+                    connection.bytes_sent += len(frame)
+        except websockets.exceptions.ConnectionClosed:
+            logger.info(f"WebSocket closed while sending to {connection.connection_id}")
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.error(f"Writer error for {connection.connection_id}: {str(e)}")
+    
     async def _stream_rdp(self, connection: StreamingConnection):
         """Stream RDP protocol data"""
         logger.info(f"Starting RDP streaming for {connection.connection_id}")
@@ -486,17 +733,20 @@ class StreamingGateway:
     
     def _allocate_port(self, env_id: str) -> int:
         """Allocate a port for streaming server"""
-        for port in self.port_pool:
-            if port not in self.allocated_ports.values():
-                self.allocated_ports[env_id] = port
-                return port
+        # An environment holds one port; a new server for it replaces the old one
+        self._release_port(env_id)
+        
+        if not self._free_ports:
+            raise RuntimeError("No available ports for streaming")
         
-        raise RuntimeError("No available ports for streaming")
+        port = self._free_ports.pop()
+        self.allocated_ports[env_id] = port
+        return port
     
     def _release_port(self, env_id: str):
         """Release allocated port"""
         if env_id in self.allocated_ports:
-            del self.allocated_ports[env_id]
+            self._free_ports.add(self.allocated_ports.pop(env_id))
     
     async def _initialize_spice(self):
         """Initialize SPICE protocol support"""
@@ -514,13 +764,20 @@ class StreamingGateway:
         """Monitor connection health and performance"""
         while self.running:
             try:
-                current_time = asyncio.get_event_loop().time()
+                current_time = time.monotonic()
                 
                 for connection in self.connections.values():
                     # Check for inactive connections
                     if current_time - connection.last_activity > 300:  # 5 minutes
                         logger.warning(f"Connection {connection.connection_id} inactive")
                     
+                    # Turn the send counter into a rate over the interval since the last sample
+                    elapsed = current_time - connection.sampled_at
+                    if elapsed > 0:
+                        connection.bandwidth_usage = int((connection.bytes_sent - connection.sampled_bytes) / elapsed)
+                    connection.sampled_bytes = connection.bytes_sent
+                    connection.sampled_at = current_time
+                    
                     # Monitor bandwidth and adjust quality if needed
                     if connection.quality == StreamQuality.AUTO:
                         await self._auto_adjust_quality(connection)
@@ -532,23 +789,36 @@ class StreamingGateway:
                 await asyncio.sleep(30)
     
     async def _cleanup_inactive_connections(self):
-        """Cleanup inactive connections"""
+        """Cleanup inactive connections, sleeping until the next one could expire"""
+        heap = self._expiry_heap
         while self.running:
             try:
-                current_time = asyncio.get_event_loop().time()
-                inactive_connections = []
+                if not heap:
+                    self._expiry_added.clear()
+                    await self._expiry_added.wait()
+                    continue
                 
-                for connection_id, connection in self.connections.items():
-                    # Mark connections inactive after 10 minutes
-                    if current_time - connection.last_activity > 600:
-                        inactive_connections.append(connection_id)
+                # Every connection gets the same timeout, so new entries never expire
+                # before the current head and the sleep needn't be interrupted
+                current_time = time.monotonic()
+                expires_at, connection_id = heap[0]
+                if expires_at > current_time:
+                    await asyncio.sleep(expires_at - current_time)
+                    continue
                 
-                # Disconnect inactive connections
-                for connection_id in inactive_connections:
-                    logger.info(f"Cleaning up inactive connection {connection_id}")
-                    await self.disconnect_client(connection_id)
+                heapq.heappop(heap)
+                connection = self.connections.get(connection_id)
+                if connection is None:
+                    continue
                 
-                await asyncio.sleep(60)  # Check every minute
+                # Active since this entry was queued: check again at its new expiry
+                expires_at = connection.last_activity + INACTIVE_TIMEOUT
+                if expires_at > current_time:
+                    heapq.heappush(heap, (expires_at, connection_id))
+                    continue
+                
+                logger.info(f"Cleaning up inactive connection {connection_id}")
+                await self.disconnect_client(connection_id)
                 
             except Exception as e:
                 logger.error(f"Cleanup error: {str(e)}")
@@ -580,25 +850,22 @@ class StreamingGateway:
                 "compression": connection.compression_level
             }
             
-            try:
-                await connection.websocket.send(json.dumps(quality_update))
-            except:
-                pass
+            self._enqueue(connection, orjson.dumps(quality_update))
     
     async def _handle_spice_input(self, connection: StreamingConnection, event: Dict[str, Any]):
         """Handle SPICE input events"""
         # Forward input to SPICE server
-        logger.debug(f"SPICE input from {connection.connection_id}: {event}")
+        logger.debug("SPICE input from %s: %s", connection.connection_id, event)
     
     async def _handle_rdp_input(self, connection: StreamingConnection, event: Dict[str, Any]):
         """Handle RDP input events"""
         # Forward input to RDP server
-        logger.debug(f"RDP input from {connection.connection_id}: {event}")
+        logger.debug("RDP input from %s: %s", connection.connection_id, event)
     
     async def _handle_vnc_input(self, connection: StreamingConnection, event: Dict[str, Any]):
         """Handle VNC input events"""
         # Forward input to VNC server
-        logger.debug(f"VNC input from {connection.connection_id}: {event}")
+        logger.debug("VNC input from %s: %s", connection.connection_id, event)
     
     async def _handle_resolution_change(self, connection_id: str, data: Dict[str, Any]):
         """Handle resolution change request"""
@@ -645,24 +912,23 @@ class StreamingGateway:
         """Stop all streaming servers"""
         logger.info("Stopping all streaming servers")
         
-        # Stop all SPICE servers
-        for process in self.spice_servers.values():
-            process.terminate()
-        
-        # Stop all RDP servers
-        for process in self.rdp_servers.values():
-            process.terminate()
-        
-        # Wait for processes to terminate
-        await asyncio.sleep(2)
+        processes = list(self.spice_servers.values()) + list(self.rdp_servers.values())
+        for process in processes:
+            if process.returncode is None:
+                process.terminate()
         
-        # Force kill if necessary
-        for process in list(self.spice_servers.values()) + list(self.rdp_servers.values()):
-            if process.poll() is None:
-                process.kill()
+        # Wait only as long as the slowest server takes, up to the grace period
+        try:
+            await asyncio.wait_for(asyncio.gather(*(process.wait() for process in processes)), timeout=2)
+        except asyncio.TimeoutError:
+            # Force kill stragglers
+            for process in processes:
+                if process.returncode is None:
+                    process.kill()
         
         self.spice_servers.clear()
         self.rdp_servers.clear()
+        self._free_ports.update(self.allocated_ports.values())
         self.allocated_ports.clear()
 
 # Global streaming gateway instance
@@ -4,26 +4,105 @@ Implements specific protocol handling for SPICE, RDP, VNC, and WebRTC
 """
 
 import asyncio
+import os
 import struct
-import socket
 import ssl
-import json
-from typing import Dict, Any, Optional, Tuple, List
+import threading
+import time
+from typing import Awaitable, Callable, Dict, Any, Optional, Tuple, List
 from abc import ABC, abstractmethod
-import base64
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+import orjson
+import lz4.frame
+import zstandard
+from pathlib import Path
 
+from ..api.core.config import settings
 from ..api.core.logging import get_logger
 
 logger = get_logger(__name__)
 
+# Binary frame header (message type, timestamp, flags, payload length), followed by
+# the raw frame bytes; per-stream metadata goes out once in the JSON handshake, which
+# stays a text message so clients can tell it apart from frames.
+# Header and payload are sent as two fragments of one message so the payload is
+# never copied into a joined bytes object
+FRAME_HEADER = struct.Struct("<BdII")
+SPICE_FRAME = 1
+RDP_FRAME = 2
+VNC_FRAME = 3
+
+# Frame header flags; FRAME_ZSTD marks a compressed frame that used the zstd
+# dictionary instead of LZ4
+FRAME_COMPRESSED = 0x1
+FRAME_ZSTD = 0x2
+
+# LZ4 fast mode; each frame is compressed independently so one result is shared
+# by every client of a frame variant
+LZ4_COMPRESSION_LEVEL = 0
+
+# Pending-connection queue for the raw protocol listeners, so a burst of
+# reconnecting viewers isn't refused
+ACCEPT_BACKLOG = 128
+
+# zstd level used with a trained frame dictionary
+ZSTD_COMPRESSION_LEVEL = 1
+
+# Frames at least this large are compressed on the encode pool; smaller ones cost
+# less than the thread handoff
+OFFLOAD_FRAME_BYTES = 64 * 1024
+
+# Threads for frame compression, shared by every handler; lz4 and zstd release the GIL
+ENCODE_POOL_SIZE = os.cpu_count() or 4
+_encode_pool = ThreadPoolExecutor(max_workers=ENCODE_POOL_SIZE, thread_name_prefix="frame-encode")
+
+def _load_zstd_dictionary(path: Optional[str]) -> Optional[zstandard.ZstdCompressionDict]:
+    """Load a frame dictionary trained offline with zstandard.train_dictionary"""
+    if not path:
+        return None
+    try:
+        dictionary = zstandard.ZstdCompressionDict(Path(path).read_bytes())
+        dictionary.precompute_compress(level=ZSTD_COMPRESSION_LEVEL)
+        return dictionary
+    except (OSError, zstandard.ZstdError) as e:
+        logger.warning(f"Failed to load zstd frame dictionary {path}, using LZ4: {str(e)}")
+        return None
+
+@dataclass(slots=True)
+class ClientState:
+    """State of a client attached to a protocol handler"""
+    websocket: Any
+    connected_at: float
+    last_activity_tick: int  # Handler tick of the last input; idle time is ticks * frame_interval
+    capabilities: Dict[str, bool] = field(default_factory=dict)
+    authenticated: bool = False  # RDP only
+    protocol_version: Optional[str] = None  # VNC only
+    encoding: Optional[str] = None  # VNC only
+    # SPICE only: frame encoder picked from the capabilities once, at connect
+    frame_encoder: Optional[Callable[[bytes], Awaitable[Tuple[bytes, bytes]]]] = None
+    # Frame send in flight and the latest frame waiting behind it; a newer frame replaces it
+    send_task: Optional[asyncio.Task] = None
+    pending_frame: Optional[Tuple[bytes, bytes]] = None
+    frames_dropped: int = 0
+
 class StreamingProtocolHandler(ABC):
     """Abstract base class for streaming protocol handlers"""
     
+    # Seconds between display updates, one shared tick for all of a handler's clients
+    frame_interval = 1 / 30
+    
     def __init__(self, env_id: str, port: int):
         self.env_id = env_id
         self.port = port
         self.running = False
-        self.clients: Dict[str, Any] = {}
+        self.clients: Dict[str, ClientState] = {}
+        self.tick_task: Optional[asyncio.Task] = None
+        # Display rounds run so far; a cheap clock for client activity
+        self.tick = 0
+        # Serialized handshake and the capability flags it was built from
+        self._handshake_flags: Optional[Tuple] = None
+        self._handshake_text = ""
     
     @abstractmethod
     async def start_server(self) -> bool:
@@ -49,34 +128,130 @@ class StreamingProtocolHandler(ABC):
     async def send_frame(self, client_id: str, frame_data: bytes) -> bool:
         """Send frame data to client"""
         pass
+    
+    @abstractmethod
+    def _capability_flags(self) -> Tuple:
+        """Handler settings the handshake depends on"""
+        pass
+    
+    @abstractmethod
+    def _build_handshake(self) -> Dict[str, Any]:
+        """Build the handshake message sent to new clients"""
+        pass
+    
+    def _handshake(self) -> str:
+        """Handshake message text, re-serialized only when a capability flag changes"""
+        flags = self._capability_flags()
+        if flags != self._handshake_flags:
+            self._handshake_text = orjson.dumps(self._build_handshake()).decode()
+            self._handshake_flags = flags
+        return self._handshake_text
+    
+    @abstractmethod
+    async def _capture_frame(self) -> bytes:
+        """Capture the current display"""
+        pass
+    
+    @abstractmethod
+    def _frame_variant(self, client: ClientState) -> Any:
+        """Key shared by clients that receive identical frame bytes, or None for no frames"""
+        pass
+    
+    @abstractmethod
+    async def _encode_frame(self, client: ClientState, frame_data: bytes) -> Tuple[bytes, bytes]:
+        """Build the (header, payload) message parts of a frame for a client"""
+        pass
+    
+    async def _tick_loop(self):
+        """Send a display update to every client once per frame interval"""
+        next_tick = time.monotonic()
+        while self.running:
+            # Ticks missed behind a slow round are dropped rather than sent in a burst
+            next_tick = max(next_tick + self.frame_interval, time.monotonic())
+            await asyncio.sleep(next_tick - time.monotonic())
+            self.tick += 1
+            
+            try:
+                await self._broadcast_frame(await self._capture_frame())
+            except Exception as e:
+                logger.error(f"Display update error for environment {self.env_id}: {str(e)}")
+    
+    async def _broadcast_frame(self, frame_data: bytes):
+        """Offer a frame to every client, encoding it once per frame variant"""
+        encoded: Dict[Any, Tuple[bytes, bytes]] = {}
+        for client_id, client in list(self.clients.items()):
+            variant = self._frame_variant(client)
+            if variant is None:
+                continue
+            parts = encoded.get(variant)
+            if parts is None:
+                parts = encoded[variant] = await self._encode_frame(client, frame_data)
+            self._offer_frame(client_id, client, parts)
+    
+    def _offer_frame(self, client_id: str, client: ClientState, parts: Tuple[bytes, bytes]):
+        """Start sending a frame, or park it behind the client's unfinished send"""
+        # The tick never waits on a send, so a slow viewer only drops its own frames
+        if client.send_task is not None:
+            if client.pending_frame is not None:
+                client.frames_dropped += 1
+            client.pending_frame = parts
+            return
+        client.send_task = asyncio.create_task(self._send_frames(client_id, client, parts))
+    
+    async def _send_frames(self, client_id: str, client: ClientState, parts: Tuple[bytes, bytes]):
+        """Send a frame, then whichever frame was parked while it was in flight"""
+        while parts is not None:
+            await self._send_encoded_frame(client_id, client.websocket, parts)
+            parts, client.pending_frame = client.pending_frame, None
+        client.send_task = None
+    
+    async def _send_encoded_frame(self, client_id: str, websocket, parts: Tuple[bytes, bytes]):
+        """Send prepared frame parts as one fragmented binary message"""
+        try:
+            await websocket.send(parts)
+        except Exception as e:
+            logger.error(f"Failed to send frame to {client_id}: {str(e)}")
 
 class SPICEHandler(StreamingProtocolHandler):
     """SPICE protocol handler"""
     
     def __init__(self, env_id: str, port: int):
         super().__init__(env_id, port)
-        self.spice_socket = None
-        self.server_task = None
+        self.spice_server: Optional[asyncio.AbstractServer] = None
         self.compression_enabled = True
         self.audio_enabled = True
         self.clipboard_enabled = True
+        # Input coroutine by event input_type
+        self._input_handlers = {
+            "keyboard": self._handle_keyboard_input,
+            "mouse": self._handle_mouse_input,
+            "clipboard": self._handle_clipboard_input
+        }
+        # Shared by every client: frames stay independent, the dictionary carries
+        # what successive desktop frames have in common
+        self.zstd_dictionary = _load_zstd_dictionary(settings.spice_zstd_dictionary_path)
+        # ZstdCompressor isn't safe to share between threads, so each encode thread builds its own
+        self._zstd_local = threading.local()
+        self.compression_flags = FRAME_COMPRESSED | (FRAME_ZSTD if self.zstd_dictionary else 0)
     
     async def start_server(self) -> bool:
         """Start SPICE server"""
         logger.info(f"Starting SPICE server for environment {self.env_id} on port {self.port}")
         
         try:
-            # Create SPICE server socket
-            self.spice_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.spice_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self.spice_socket.bind(('0.0.0.0', self.port))
-            self.spice_socket.listen(5)
-            self.spice_socket.setblocking(False)
+            # Create SPICE server; asyncio accepts and spawns a handler per connection
+            self.spice_server = await asyncio.start_server(
+                self._handle_raw_connection,
+                '0.0.0.0',
+                self.port,
+                backlog=ACCEPT_BACKLOG,
+                reuse_address=True
+            )
             
             self.running = True
             
-            # Start server task
-            self.server_task = asyncio.create_task(self._server_loop())
+            # Start the shared display tick
+            self.tick_task = asyncio.create_task(self._tick_loop())
             
             logger.info(f"SPICE server started on port {self.port}")
             return True
@@ -91,16 +266,17 @@ class SPICEHandler(StreamingProtocolHandler):
         
         self.running = False
         
-        if self.server_task:
-            self.server_task.cancel()
+        if self.spice_server:
+            self.spice_server.close()
+            await self.spice_server.wait_closed()
+        
+        if self.tick_task:
+            self.tick_task.cancel()
             try:
-                await self.server_task
+                await self.tick_task
             except asyncio.CancelledError:
                 pass
         
-        if self.spice_socket:
-            self.spice_socket.close()
-        
         # Disconnect all clients
         for client_id in list(self.clients.keys()):
             await self._disconnect_client(client_id)
@@ -114,30 +290,20 @@ class SPICEHandler(StreamingProtocolHandler):
         
         try:
             # Store client info
-            self.clients[client_id] = {
-                "websocket": websocket,
-                "connected_at": asyncio.get_event_loop().time(),
-                "last_activity": asyncio.get_event_loop().time(),
-                "capabilities": {
+            self.clients[client_id] = ClientState(
+                websocket=websocket,
+                connected_at=time.monotonic(),
+                last_activity_tick=self.tick,
+                capabilities={
                     "compression": self.compression_enabled,
                     "audio": self.audio_enabled,
                     "clipboard": self.clipboard_enabled
-                }
-            }
+                },
+                frame_encoder=self._encode_compressed_frame if self.compression_enabled else self._encode_raw_frame
+            )
             
             # Send initial handshake
-            handshake = {
-                "type": "spice_handshake",
-                "version": "1.0",
-                "capabilities": self.clients[client_id]["capabilities"],
-                "resolution": (1920, 1080),
-                "color_depth": 24
-            }
-            
-            await websocket.send(json.dumps(handshake))
-            
-            # Start client handler
-            asyncio.create_task(self._handle_client(client_id))
+            await websocket.send(self._handshake())
             
             return True
             
@@ -147,22 +313,18 @@ class SPICEHandler(StreamingProtocolHandler):
     
     async def handle_input_event(self, client_id: str, event: Dict[str, Any]) -> bool:
         """Handle SPICE input event"""
-        if client_id not in self.clients:
+        client = self.clients.get(client_id)
+        if client is None:
             return False
         
         try:
             # Update last activity
-            self.clients[client_id]["last_activity"] = asyncio.get_event_loop().time()
+            client.last_activity_tick = self.tick
             
             # Process different input types
-            input_type = event.get("input_type")
-            
-            if input_type == "keyboard":
-                await self._handle_keyboard_input(event)
-            elif input_type == "mouse":
-                await self._handle_mouse_input(event)
-            elif input_type == "clipboard":
-                await self._handle_clipboard_input(event)
+            handler = self._input_handlers.get(event.get("input_type"))
+            if handler is not None:
+                await handler(event)
             
             return True
             
@@ -172,55 +334,23 @@ class SPICEHandler(StreamingProtocolHandler):
     
     async def send_frame(self, client_id: str, frame_data: bytes) -> bool:
         """Send SPICE frame to client"""
-        if client_id not in self.clients:
+        client = self.clients.get(client_id)
+        if client is None:
             return False
         
         try:
-            client = self.clients[client_id]
-            websocket = client["websocket"]
-            
-            # Compress frame if enabled
-            if client["capabilities"]["compression"]:
-                frame_data = await self._compress_frame(frame_data)
-            
-            # Encode frame data
-            encoded_frame = base64.b64encode(frame_data).decode('utf-8')
-            
-            # Send frame
-            frame_message = {
-                "type": "spice_frame",
-                "timestamp": asyncio.get_event_loop().time(),
-                "data": encoded_frame,
-                "compressed": client["capabilities"]["compression"]
-            }
-            
-            await websocket.send(json.dumps(frame_message))
+            # Send header and raw frame bytes as one fragmented binary message
+            await client.websocket.send(await self._encode_frame(client, frame_data))
             return True
             
         except Exception as e:
             logger.error(f"Failed to send SPICE frame: {str(e)}")
             return False
     
-    async def _server_loop(self):
-        """Main SPICE server loop"""
-        loop = asyncio.get_event_loop()
-        
-        while self.running:
-            try:
-                # Accept new connections
-                client_socket, addr = await loop.sock_accept(self.spice_socket)
-                logger.info(f"New SPICE connection from {addr}")
-                
-                # Handle connection in background
-                asyncio.create_task(self._handle_raw_connection(client_socket, addr))
-                
-            except Exception as e:
-                if self.running:
-                    logger.error(f"SPICE server loop error: {str(e)}")
-                await asyncio.sleep(0.1)
-    
-    async def _handle_raw_connection(self, client_socket, addr):
+    async def _handle_raw_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
         """Handle raw SPICE connection"""
+        addr = writer.get_extra_info("peername")
+        
         try:
             # In a real implementation, this would handle the SPICE protocol
             # For now, we'll simulate the connection
@@ -232,26 +362,49 @@ class SPICEHandler(StreamingProtocolHandler):
         except Exception as e:
             logger.error(f"Error handling SPICE connection: {str(e)}")
         finally:
-            client_socket.close()
+            writer.close()
+    
+    def _capability_flags(self) -> Tuple:
+        """Capability flags advertised in the handshake"""
+        return (self.compression_enabled, self.audio_enabled, self.clipboard_enabled)
+    
+    def _build_handshake(self) -> Dict[str, Any]:
+        """Build the SPICE handshake"""
+        return {
+            "type": "spice_handshake",
+            "version": "1.0",
+            "capabilities": {
+                "compression": self.compression_enabled,
+                "audio": self.audio_enabled,
+                "clipboard": self.clipboard_enabled
+            },
+            "compression_codec": "zstd" if self.zstd_dictionary else "lz4",
+            "zstd_dictionary_id": self.zstd_dictionary.dict_id() if self.zstd_dictionary else None,
+            "resolution": (1920, 1080),
+            "color_depth": 24
+        }
+    
+    async def _capture_frame(self) -> bytes:
+        """Capture the display"""
+        # Simulate frame data
+        return b"simulated_spice_frame_data"
     
-    async def _handle_client(self, client_id: str):
-        """Handle individual client"""
-        try:
-            while client_id in self.clients and self.running:
-                # Send periodic frames
-                await self._send_display_update(client_id)
-                await asyncio.sleep(1/30)  # 30 FPS
-                
-        except Exception as e:
-            logger.error(f"Error handling SPICE client {client_id}: {str(e)}")
-        finally:
-            await self._disconnect_client(client_id)
+    def _frame_variant(self, client: ClientState) -> Any:
+        """Clients differ only in whether they take compressed frames"""
+        return client.capabilities["compression"]
     
-    async def _send_display_update(self, client_id: str):
-        """Send display update to client"""
-        # Simulate frame data
-        frame_data = b"simulated_spice_frame_data"
-        await self.send_frame(client_id, frame_data)
+    async def _encode_frame(self, client: ClientState, frame_data: bytes) -> Tuple[bytes, bytes]:
+        """Encode the frame with the encoder chosen for the client at connect"""
+        return await client.frame_encoder(frame_data)
+    
+    async def _encode_compressed_frame(self, frame_data: bytes) -> Tuple[bytes, bytes]:
+        """Compress the frame and prepend the header"""
+        frame_data = await self._compress_frame(frame_data)
+        return FRAME_HEADER.pack(SPICE_FRAME, time.monotonic(), self.compression_flags, len(frame_data)), frame_data
+    
+    async def _encode_raw_frame(self, frame_data: bytes) -> Tuple[bytes, bytes]:
+        """Prepend the header to the uncompressed frame"""
+        return FRAME_HEADER.pack(SPICE_FRAME, time.monotonic(), 0, len(frame_data)), frame_data
     
     async def _handle_keyboard_input(self, event: Dict[str, Any]):
         """Handle keyboard input"""
@@ -259,7 +412,7 @@ class SPICEHandler(StreamingProtocolHandler):
         action = event.get("action")  # press, release
         modifiers = event.get("modifiers", [])
         
-        logger.debug(f"SPICE keyboard: {action} {key} with modifiers {modifiers}")
+        logger.debug("SPICE keyboard: %s %s with modifiers %s", action, key, modifiers)
         
         # In real implementation, forward to VM/container
     
@@ -270,7 +423,7 @@ class SPICEHandler(StreamingProtocolHandler):
         button = event.get("button")
         action = event.get("action")  # move, press, release, wheel
         
-        logger.debug(f"SPICE mouse: {action} at ({x}, {y}) button {button}")
+        logger.debug("SPICE mouse: %s at (%s, %s) button %s", action, x, y, button)
         
         # In real implementation, forward to VM/container
     
@@ -279,54 +432,77 @@ class SPICEHandler(StreamingProtocolHandler):
         data = event.get("data")
         data_type = event.get("data_type", "text")
         
-        logger.debug(f"SPICE clipboard: {data_type} data")
+        logger.debug("SPICE clipboard: %s data", data_type)
         
         # In real implementation, sync clipboard with VM/container
     
     async def _compress_frame(self, frame_data: bytes) -> bytes:
-        """Compress frame data"""
-        # Simple compression simulation
-        # In real implementation, use proper compression algorithms
-        return frame_data
+        """Compress frame data, on the encode pool once it outweighs the thread handoff"""
+        if len(frame_data) < OFFLOAD_FRAME_BYTES:
+            return self._compress(frame_data)
+        return await asyncio.get_running_loop().run_in_executor(_encode_pool, self._compress, frame_data)
+    
+    def _compress(self, frame_data: bytes) -> bytes:
+        """Compress frame data as a self-contained zstd or LZ4 frame"""
+        if self.zstd_dictionary is not None:
+            compressor = getattr(self._zstd_local, "compressor", None)
+            if compressor is None:
+                compressor = zstandard.ZstdCompressor(level=ZSTD_COMPRESSION_LEVEL, dict_data=self.zstd_dictionary)
+                self._zstd_local.compressor = compressor
+            return compressor.compress(frame_data)
+        return lz4.frame.compress(
+            frame_data,
+            compression_level=LZ4_COMPRESSION_LEVEL,
+            block_size=lz4.frame.BLOCKSIZE_MAX256KB
+        )
     
     async def _disconnect_client(self, client_id: str):
         """Disconnect a client"""
-        if client_id in self.clients:
+        client = self.clients.pop(client_id, None)
+        if client is not None:
+            if client.send_task:
+                client.send_task.cancel()
             try:
-                websocket = self.clients[client_id]["websocket"]
-                await websocket.close()
+                await client.websocket.close()
             except:
                 pass
             
-            del self.clients[client_id]
             logger.info(f"SPICE client {client_id} disconnected")
 
 class RDPHandler(StreamingProtocolHandler):
     """RDP protocol handler"""
     
+    frame_interval = 1 / 24  # 24 FPS for RDP; unauthenticated clients get no frames
+    
     def __init__(self, env_id: str, port: int):
         super().__init__(env_id, port)
-        self.rdp_socket = None
-        self.server_task = None
+        self.rdp_server: Optional[asyncio.AbstractServer] = None
         self.tls_enabled = True
         self.nla_enabled = True  # Network Level Authentication
+        # Input coroutine by event input_type
+        self._input_handlers = {
+            "keyboard": self._handle_keyboard_input,
+            "mouse": self._handle_mouse_input
+        }
     
     async def start_server(self) -> bool:
         """Start RDP server"""
         logger.info(f"Starting RDP server for environment {self.env_id} on port {self.port}")
         
         try:
-            # Create RDP server socket
-            self.rdp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.rdp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self.rdp_socket.bind(('0.0.0.0', self.port))
-            self.rdp_socket.listen(5)
-            self.rdp_socket.setblocking(False)
+            # Create RDP server; asyncio accepts and spawns a handler per connection
+            self.rdp_server = await asyncio.start_server(
+                self._handle_raw_connection,
+                '0.0.0.0',
+                self.port,
+                backlog=ACCEPT_BACKLOG,
+                reuse_address=True
+            )
             
             self.running = True
             
-            # Start server task
-            self.server_task = asyncio.create_task(self._server_loop())
+            # Start the shared display tick
+            self.tick_task = asyncio.create_task(self._tick_loop())
             
             logger.info(f"RDP server started on port {self.port}")
             return True
@@ -341,16 +517,17 @@ class RDPHandler(StreamingProtocolHandler):
         
         self.running = False
         
-        if self.server_task:
-            self.server_task.cancel()
+        if self.rdp_server:
+            self.rdp_server.close()
+            await self.rdp_server.wait_closed()
+        
+        if self.tick_task:
+            self.tick_task.cancel()
             try:
-                await self.server_task
+                await self.tick_task
             except asyncio.CancelledError:
                 pass
         
-        if self.rdp_socket:
-            self.rdp_socket.close()
-        
         # Disconnect all clients
         for client_id in list(self.clients.keys()):
             await self._disconnect_client(client_id)
@@ -364,31 +541,19 @@ class RDPHandler(StreamingProtocolHandler):
         
         try:
             # Store client info
-            self.clients[client_id] = {
-                "websocket": websocket,
-                "connected_at": asyncio.get_event_loop().time(),
-                "last_activity": asyncio.get_event_loop().time(),
-                "authenticated": False,
-                "capabilities": {
+            self.clients[client_id] = ClientState(
+                websocket=websocket,
+                connected_at=time.monotonic(),
+                last_activity_tick=self.tick,
+                capabilities={
                     "tls": self.tls_enabled,
                     "nla": self.nla_enabled,
                     "compression": True
                 }
-            }
+            )
             
             # Send initial capabilities
-            capabilities = {
-                "type": "rdp_capabilities",
-                "version": "10.0",
-                "capabilities": self.clients[client_id]["capabilities"],
-                "resolution": (1920, 1080),
-                "color_depth": 32
-            }
-            
-            await websocket.send(json.dumps(capabilities))
-            
-            # Start client handler
-            asyncio.create_task(self._handle_client(client_id))
+            await websocket.send(self._handshake())
             
             return True
             
@@ -398,27 +563,25 @@ class RDPHandler(StreamingProtocolHandler):
     
     async def handle_input_event(self, client_id: str, event: Dict[str, Any]) -> bool:
         """Handle RDP input event"""
-        if client_id not in self.clients:
+        client = self.clients.get(client_id)
+        if client is None:
             return False
         
         try:
             # Update last activity
-            self.clients[client_id]["last_activity"] = asyncio.get_event_loop().time()
+            client.last_activity_tick = self.tick
             
             # Check authentication
-            if not self.clients[client_id]["authenticated"]:
+            if not client.authenticated:
                 if event.get("type") == "authentication":
                     return await self._handle_authentication(client_id, event)
                 else:
                     return False
             
             # Process input events
-            input_type = event.get("input_type")
-            
-            if input_type == "keyboard":
-                await self._handle_keyboard_input(event)
-            elif input_type == "mouse":
-                await self._handle_mouse_input(event)
+            handler = self._input_handlers.get(event.get("input_type"))
+            if handler is not None:
+                await handler(event)
             
             return True
             
@@ -428,55 +591,27 @@ class RDPHandler(StreamingProtocolHandler):
     
     async def send_frame(self, client_id: str, frame_data: bytes) -> bool:
         """Send RDP frame to client"""
-        if client_id not in self.clients:
+        client = self.clients.get(client_id)
+        if client is None:
             return False
         
         try:
-            client = self.clients[client_id]
-            websocket = client["websocket"]
-            
             # Check authentication
-            if not client["authenticated"]:
+            if not client.authenticated:
                 return False
             
-            # Encode frame data
-            encoded_frame = base64.b64encode(frame_data).decode('utf-8')
-            
-            # Send frame
-            frame_message = {
-                "type": "rdp_frame",
-                "timestamp": asyncio.get_event_loop().time(),
-                "data": encoded_frame,
-                "format": "bitmap"
-            }
-            
-            await websocket.send(json.dumps(frame_message))
+            # Send header and raw bitmap bytes as one fragmented binary message
+            await client.websocket.send(await self._encode_frame(client, frame_data))
             return True
             
         except Exception as e:
             logger.error(f"Failed to send RDP frame: {str(e)}")
             return False
     
-    async def _server_loop(self):
-        """Main RDP server loop"""
-        loop = asyncio.get_event_loop()
-        
-        while self.running:
-            try:
-                # Accept new connections
-                client_socket, addr = await loop.sock_accept(self.rdp_socket)
-                logger.info(f"New RDP connection from {addr}")
-                
-                # Handle connection in background
-                asyncio.create_task(self._handle_raw_connection(client_socket, addr))
-                
-            except Exception as e:
-                if self.running:
-                    logger.error(f"RDP server loop error: {str(e)}")
-                await asyncio.sleep(0.1)
-    
-    async def _handle_raw_connection(self, client_socket, addr):
+    async def _handle_raw_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
         """Handle raw RDP connection"""
+        addr = writer.get_extra_info("peername")
+        
         try:
             # In a real implementation, this would handle the RDP protocol
             logger.info(f"Handling RDP connection from {addr}")
@@ -487,28 +622,39 @@ class RDPHandler(StreamingProtocolHandler):
         except Exception as e:
             logger.error(f"Error handling RDP connection: {str(e)}")
         finally:
-            client_socket.close()
+            writer.close()
+    
+    def _capability_flags(self) -> Tuple:
+        """Capability flags advertised in the capabilities message"""
+        return (self.tls_enabled, self.nla_enabled)
+    
+    def _build_handshake(self) -> Dict[str, Any]:
+        """Build the RDP capabilities message"""
+        return {
+            "type": "rdp_capabilities",
+            "version": "10.0",
+            "capabilities": {
+                "tls": self.tls_enabled,
+                "nla": self.nla_enabled,
+                "compression": True
+            },
+            "resolution": (1920, 1080),
+            "color_depth": 32,
+            "frame_format": "bitmap"
+        }
+    
+    async def _capture_frame(self) -> bytes:
+        """Capture the RDP display"""
+        # Simulate frame data
+        return b"simulated_rdp_frame_data"
     
-    async def _handle_client(self, client_id: str):
-        """Handle individual RDP client"""
-        try:
-            while client_id in self.clients and self.running:
-                if self.clients[client_id]["authenticated"]:
-                    # Send periodic frames
-                    await self._send_display_update(client_id)
-                
-                await asyncio.sleep(1/24)  # 24 FPS for RDP
-                
-        except Exception as e:
-            logger.error(f"Error handling RDP client {client_id}: {str(e)}")
-        finally:
-            await self._disconnect_client(client_id)
+    def _frame_variant(self, client: ClientState) -> Any:
+        """Every authenticated client gets the same bitmap; others get no frames"""
+        return "bitmap" if client.authenticated else None
     
-    async def _send_display_update(self, client_id: str):
-        """Send display update to RDP client"""
-        # Simulate frame data
-        frame_data = b"simulated_rdp_frame_data"
-        await self.send_frame(client_id, frame_data)
+    async def _encode_frame(self, client: ClientState, frame_data: bytes) -> Tuple[bytes, bytes]:
+        """Prepend the header to the raw bitmap"""
+        return FRAME_HEADER.pack(RDP_FRAME, time.monotonic(), 0, len(frame_data)), frame_data
     
     async def _handle_authentication(self, client_id: str, event: Dict[str, Any]) -> bool:
         """Handle RDP authentication"""
@@ -518,7 +664,8 @@ class RDPHandler(StreamingProtocolHandler):
         # Simple authentication simulation
         # In real implementation, validate against system or directory
         if username and password:
-            self.clients[client_id]["authenticated"] = True
+            client = self.clients[client_id]
+            client.authenticated = True
             
             # Send authentication success
             auth_response = {
@@ -527,7 +674,7 @@ class RDPHandler(StreamingProtocolHandler):
                 "session_id": f"rdp_session_{client_id}"
             }
             
-            await self.clients[client_id]["websocket"].send(json.dumps(auth_response))
+            await client.websocket.send(orjson.dumps(auth_response).decode())
             logger.info(f"RDP client {client_id} authenticated as {username}")
             return True
         
@@ -538,7 +685,7 @@ class RDPHandler(StreamingProtocolHandler):
         key = event.get("key")
         action = event.get("action")
         
-        logger.debug(f"RDP keyboard: {action} {key}")
+        logger.debug("RDP keyboard: %s %s", action, key)
         
         # In real implementation, forward to Windows VM
     
@@ -549,48 +696,59 @@ class RDPHandler(StreamingProtocolHandler):
         button = event.get("button")
         action = event.get("action")
         
-        logger.debug(f"RDP mouse: {action} at ({x}, {y}) button {button}")
+        logger.debug("RDP mouse: %s at (%s, %s) button %s", action, x, y, button)
         
         # In real implementation, forward to Windows VM
     
     async def _disconnect_client(self, client_id: str):
         """Disconnect RDP client"""
-        if client_id in self.clients:
+        client = self.clients.pop(client_id, None)
+        if client is not None:
+            if client.send_task:
+                client.send_task.cancel()
             try:
-                websocket = self.clients[client_id]["websocket"]
-                await websocket.close()
+                await client.websocket.close()
             except:
                 pass
             
-            del self.clients[client_id]
             logger.info(f"RDP client {client_id} disconnected")
 
 class VNCHandler(StreamingProtocolHandler):
     """VNC protocol handler"""
     
+    frame_interval = 1 / 15  # 15 FPS for VNC
+    
     def __init__(self, env_id: str, port: int):
         super().__init__(env_id, port)
-        self.vnc_socket = None
-        self.server_task = None
+        self.vnc_server: Optional[asyncio.AbstractServer] = None
         self.password_required = False
         self.shared_sessions = True
+        self.encoding = "raw"
+        # Input coroutine by event input_type
+        self._input_handlers = {
+            "keyboard": self._handle_keyboard_input,
+            "mouse": self._handle_mouse_input,
+            "pointer": self._handle_pointer_input
+        }
     
     async def start_server(self) -> bool:
         """Start VNC server"""
         logger.info(f"Starting VNC server for environment {self.env_id} on port {self.port}")
         
         try:
-            # Create VNC server socket
-            self.vnc_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.vnc_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self.vnc_socket.bind(('0.0.0.0', self.port))
-            self.vnc_socket.listen(5)
-            self.vnc_socket.setblocking(False)
+            # Create VNC server; asyncio accepts and spawns a handler per connection
+            self.vnc_server = await asyncio.start_server(
+                self._handle_raw_connection,
+                '0.0.0.0',
+                self.port,
+                backlog=ACCEPT_BACKLOG,
+                reuse_address=True
+            )
             
             self.running = True
             
-            # Start server task
-            self.server_task = asyncio.create_task(self._server_loop())
+            # Start the shared display tick
+            self.tick_task = asyncio.create_task(self._tick_loop())
             
             logger.info(f"VNC server started on port {self.port}")
             return True
@@ -605,16 +763,17 @@ class VNCHandler(StreamingProtocolHandler):
         
         self.running = False
         
-        if self.server_task:
-            self.server_task.cancel()
+        if self.vnc_server:
+            self.vnc_server.close()
+            await self.vnc_server.wait_closed()
+        
+        if self.tick_task:
+            self.tick_task.cancel()
             try:
-                await self.server_task
+                await self.tick_task
             except asyncio.CancelledError:
                 pass
         
-        if self.vnc_socket:
-            self.vnc_socket.close()
-        
         # Disconnect all clients
         for client_id in list(self.clients.keys()):
             await self._disconnect_client(client_id)
@@ -628,32 +787,16 @@ class VNCHandler(StreamingProtocolHandler):
         
         try:
             # Store client info
-            self.clients[client_id] = {
-                "websocket": websocket,
-                "connected_at": asyncio.get_event_loop().time(),
-                "last_activity": asyncio.get_event_loop().time(),
-                "protocol_version": "3.8",
-                "encoding": "raw"
-            }
+            self.clients[client_id] = ClientState(
+                websocket=websocket,
+                connected_at=time.monotonic(),
+                last_activity_tick=self.tick,
+                protocol_version="3.8",
+                encoding=self.encoding
+            )
             
             # Send VNC handshake
-            handshake = {
-                "type": "vnc_handshake",
-                "protocol_version": "RFB 003.008\\n",
-                "security_types": [1] if not self.password_required else [2],  # None or VNC auth
-                "resolution": (1920, 1080),
-                "pixel_format": {
-                    "bits_per_pixel": 32,
-                    "depth": 24,
-                    "big_endian": False,
-                    "true_color": True
-                }
-            }
-            
-            await websocket.send(json.dumps(handshake))
-            
-            # Start client handler
-            asyncio.create_task(self._handle_client(client_id))
+            await websocket.send(self._handshake())
             
             return True
             
@@ -663,22 +806,18 @@ class VNCHandler(StreamingProtocolHandler):
     
     async def handle_input_event(self, client_id: str, event: Dict[str, Any]) -> bool:
         """Handle VNC input event"""
-        if client_id not in self.clients:
+        client = self.clients.get(client_id)
+        if client is None:
             return False
         
         try:
             # Update last activity
-            self.clients[client_id]["last_activity"] = asyncio.get_event_loop().time()
+            client.last_activity_tick = self.tick
             
             # Process input events
-            input_type = event.get("input_type")
-            
-            if input_type == "keyboard":
-                await self._handle_keyboard_input(event)
-            elif input_type == "mouse":
-                await self._handle_mouse_input(event)
-            elif input_type == "pointer":
-                await self._handle_pointer_input(event)
+            handler = self._input_handlers.get(event.get("input_type"))
+            if handler is not None:
+                await handler(event)
             
             return True
             
@@ -688,57 +827,23 @@ class VNCHandler(StreamingProtocolHandler):
     
     async def send_frame(self, client_id: str, frame_data: bytes) -> bool:
         """Send VNC frame to client"""
-        if client_id not in self.clients:
+        client = self.clients.get(client_id)
+        if client is None:
             return False
         
         try:
-            client = self.clients[client_id]
-            websocket = client["websocket"]
-            
-            # Encode frame data
-            encoded_frame = base64.b64encode(frame_data).decode('utf-8')
-            
-            # Send frame update
-            frame_message = {
-                "type": "vnc_frame_update",
-                "timestamp": asyncio.get_event_loop().time(),
-                "rectangles": [{
-                    "x": 0,
-                    "y": 0,
-                    "width": 1920,
-                    "height": 1080,
-                    "encoding": client["encoding"],
-                    "data": encoded_frame
-                }]
-            }
-            
-            await websocket.send(json.dumps(frame_message))
+            # Send header and the full-screen rectangle as one fragmented binary message
+            await client.websocket.send(await self._encode_frame(client, frame_data))
             return True
             
         except Exception as e:
             logger.error(f"Failed to send VNC frame: {str(e)}")
             return False
     
-    async def _server_loop(self):
-        """Main VNC server loop"""
-        loop = asyncio.get_event_loop()
-        
-        while self.running:
-            try:
-                # Accept new connections
-                client_socket, addr = await loop.sock_accept(self.vnc_socket)
-                logger.info(f"New VNC connection from {addr}")
-                
-                # Handle connection in background
-                asyncio.create_task(self._handle_raw_connection(client_socket, addr))
-                
-            except Exception as e:
-                if self.running:
-                    logger.error(f"VNC server loop error: {str(e)}")
-                await asyncio.sleep(0.1)
-    
-    async def _handle_raw_connection(self, client_socket, addr):
+    async def _handle_raw_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
         """Handle raw VNC connection"""
+        addr = writer.get_extra_info("peername")
+        
         try:
             # In a real implementation, this would handle the VNC protocol
             logger.info(f"Handling VNC connection from {addr}")
@@ -749,33 +854,47 @@ class VNCHandler(StreamingProtocolHandler):
         except Exception as e:
             logger.error(f"Error handling VNC connection: {str(e)}")
         finally:
-            client_socket.close()
-    
-    async def _handle_client(self, client_id: str):
-        """Handle individual VNC client"""
-        try:
-            while client_id in self.clients and self.running:
-                # Send periodic frames
-                await self._send_display_update(client_id)
-                await asyncio.sleep(1/15)  # 15 FPS for VNC
-                
-        except Exception as e:
-            logger.error(f"Error handling VNC client {client_id}: {str(e)}")
-        finally:
-            await self._disconnect_client(client_id)
+            writer.close()
+    
+    def _capability_flags(self) -> Tuple:
+        """Settings advertised in the handshake"""
+        return (self.password_required, self.encoding)
+    
+    def _build_handshake(self) -> Dict[str, Any]:
+        """Build the VNC handshake"""
+        return {
+            "type": "vnc_handshake",
+            "protocol_version": "RFB 003.008\\n",
+            "security_types": [1] if not self.password_required else [2],  # None or VNC auth
+            "resolution": (1920, 1080),
+            "encoding": self.encoding,  # Frames are full-screen rectangles
+            "pixel_format": {
+                "bits_per_pixel": 32,
+                "depth": 24,
+                "big_endian": False,
+                "true_color": True
+            }
+        }
     
-    async def _send_display_update(self, client_id: str):
-        """Send display update to VNC client"""
+    async def _capture_frame(self) -> bytes:
+        """Capture the VNC display"""
         # Simulate frame data
-        frame_data = b"simulated_vnc_frame_data"
-        await self.send_frame(client_id, frame_data)
+        return b"simulated_vnc_frame_data"
+    
+    def _frame_variant(self, client: ClientState) -> Any:
+        """Clients are grouped by rectangle encoding"""
+        return client.encoding
+    
+    async def _encode_frame(self, client: ClientState, frame_data: bytes) -> Tuple[bytes, bytes]:
+        """Prepend the header to the full-screen rectangle"""
+        return FRAME_HEADER.pack(VNC_FRAME, time.monotonic(), 0, len(frame_data)), frame_data
     
     async def _handle_keyboard_input(self, event: Dict[str, Any]):
         """Handle VNC keyboard input"""
         key = event.get("key")
         down = event.get("down", True)
         
-        logger.debug(f"VNC keyboard: {'down' if down else 'up'} {key}")
+        logger.debug("VNC keyboard: %s %s", "down" if down else "up", key)
         
         # In real implementation, forward to X11 server
     
@@ -785,7 +904,7 @@ class VNCHandler(StreamingProtocolHandler):
         y = event.get("y", 0)
         button_mask = event.get("button_mask", 0)
         
-        logger.debug(f"VNC mouse: at ({x}, {y}) buttons {button_mask}")
+        logger.debug("VNC mouse: at (%s, %s) buttons %s", x, y, button_mask)
         
         # In real implementation, forward to X11 server
     
@@ -794,19 +913,20 @@ class VNCHandler(StreamingProtocolHandler):
         x = event.get("x", 0)
         y = event.get("y", 0)
         
-        logger.debug(f"VNC pointer: at ({x}, {y})")
+        logger.debug("VNC pointer: at (%s, %s)", x, y)
         
         # In real implementation, update cursor position
     
     async def _disconnect_client(self, client_id: str):
         """Disconnect VNC client"""
-        if client_id in self.clients:
+        client = self.clients.pop(client_id, None)
+        if client is not None:
+            if client.send_task:
+                client.send_task.cancel()
             try:
-                websocket = self.clients[client_id]["websocket"]
-                await websocket.close()
+                await client.websocket.close()
             except:
                 pass
             
-            del self.clients[client_id]
             logger.info(f"VNC client {client_id} disconnected")
 